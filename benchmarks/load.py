@@ -0,0 +1,331 @@
+"""
+HTTP load benchmark for the library API.
+
+By default the app runs in-process through httpx ``ASGITransport`` on a fresh SQLite database, so
+a run needs nothing but the repository; ``--url`` points the same workload at a running server,
+which should be started with ``RATE_LIMIT_ENABLED=false`` or its sign-ins will be counted as errors.
+Every worker signs in, reads the catalog, checks books out and returns them, picking operations
+with a seeded RNG. Latency percentiles and throughput per endpoint are written as JSON and can be
+compared with a stored baseline:
+
+    python -m benchmarks.load --concurrency 16 --duration 20 --output results.json
+    python -m benchmarks.load --save-baseline benchmarks/baseline.json
+    python -m benchmarks.load --baseline benchmarks/baseline.json  # exits with 1 on regressions
+"""
+
+# Python std lib
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import uuid
+from datetime import date
+from pathlib import Path
+from typing import Any, Awaitable, Callable
+
+# Third party
+from httpx import ASGITransport, AsyncClient, Response
+
+####################################################################################################
+# SETTINGS
+####################################################################################################
+
+PASSWORD = "benchmark-password"
+WORDS = ("river", "garden", "shadow", "empire", "winter", "ocean", "silver", "forest", "night", "stone")
+MAX_ACTIVE_LOANS = 3
+# Relative weight of each operation in the mixed workload.
+WEIGHTS = {
+    "sign_in": 1,
+    "list_books": 4,
+    "get_book": 6,
+    "search_books": 2,
+    "get_reader": 2,
+    "loan": 3,
+}
+
+####################################################################################################
+# CLASSES
+####################################################################################################
+
+class Recorder:
+    """Latencies and error counts per endpoint; requests made during the warm-up are not kept."""
+
+    def __init__(self) -> None:
+        self.recording = False
+        self.latencies: dict[str, list[float]] = {}
+        self.errors: dict[str, int] = {}
+
+    async def timed(self, endpoint: str, request: Awaitable[Response]) -> Response:
+        started = time.perf_counter()
+        response = await request
+        elapsed = time.perf_counter() - started
+        if self.recording:
+            self.latencies.setdefault(endpoint, []).append(elapsed)
+            if response.status_code >= 400:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+        return response
+
+    def summary(self, duration: float) -> dict[str, dict[str, float]]:
+        endpoints = {
+            endpoint: summarize(latencies, self.errors.get(endpoint, 0), duration)
+            for endpoint, latencies in sorted(self.latencies.items())
+        }
+        every_latency = [latency for latencies in self.latencies.values() for latency in latencies]
+        endpoints["TOTAL"] = summarize(every_latency, sum(self.errors.values()), duration)
+        return endpoints
+
+
+class Worker:
+    """One simulated librarian with a reader of its own, so its loans never hit the loan limit."""
+
+    def __init__(
+            self,
+            client: AsyncClient,
+            recorder: Recorder,
+            rng: random.Random,
+            email: str,
+            reader_id: int,
+            book_ids: list[int],
+    ) -> None:
+        self.client = client
+        self.recorder = recorder
+        self.rng = rng
+        self.email = email
+        self.reader_id = reader_id
+        self.book_ids = book_ids
+        self.loans: list[dict[str, Any]] = []
+        self.operations: dict[str, Callable[[], Awaitable[Response]]] = {
+            "sign_in": self.sign_in,
+            "list_books": self.list_books,
+            "get_book": self.get_book,
+            "search_books": self.search_books,
+            "get_reader": self.get_reader,
+            "loan": self.loan,
+        }
+
+    async def run(self, deadline: float) -> None:
+        names, weights = list(WEIGHTS), list(WEIGHTS.values())
+        while time.perf_counter() < deadline:
+            await self.operations[self.rng.choices(names, weights)[0]]()
+
+    async def sign_in(self) -> Response:
+        credentials = {"email": self.email, "password": PASSWORD}
+        return await self.recorder.timed("POST /auth/sign-in", self.client.post("/auth/sign-in", json=credentials))
+
+    async def list_books(self) -> Response:
+        params = {"limit": 20, "sort": self.rng.choice(("id", "title", "author"))}
+        return await self.recorder.timed("GET /books/", self.client.get("/books/", params=params))
+
+    async def get_book(self) -> Response:
+        book_id = self.rng.choice(self.book_ids)
+        return await self.recorder.timed("GET /books/{book_id}", self.client.get(f"/books/{book_id}"))
+
+    async def search_books(self) -> Response:
+        q = self.rng.choice(WORDS)
+        return await self.recorder.timed("GET /books/search", self.client.get("/books/search", params={"q": q}))
+
+    async def get_reader(self) -> Response:
+        return await self.recorder.timed("GET /readers/{reader_id}", self.client.get(f"/readers/{self.reader_id}"))
+
+    async def loan(self) -> Response:
+        """Check a book out, or return the oldest loan once the reader is at the limit."""
+        today = date.today().isoformat()
+        if len(self.loans) < MAX_ACTIVE_LOANS and (not self.loans or self.rng.random() < 0.5):
+            loan = {"reader_id": self.reader_id, "book_id": self.rng.choice(self.book_ids), "borrowed_date": today}
+            response = await self.recorder.timed(
+                "POST /borrowed_books/", self.client.post("/borrowed_books/", json=loan)
+            )
+            if response.status_code == 201:
+                self.loans.append(response.json())
+            return response
+
+        loan = self.loans.pop(0)
+        return await self.recorder.timed(
+            "PUT /borrowed_books/{borrowed_book_id}",
+            self.client.put(f"/borrowed_books/{loan.pop('id')}", json={**loan, "return_date": today}),
+        )
+
+####################################################################################################
+# FUNCTIONS
+####################################################################################################
+
+def percentile(sorted_values: list[float], percent: float) -> float:
+    """Nearest-rank percentile."""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(math.ceil(percent / 100 * len(sorted_values)) - 1, 0)]
+
+
+def summarize(latencies: list[float], errors: int, duration: float) -> dict[str, float]:
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / duration, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+async def in_process_client(database: Path) -> AsyncClient:
+    """The app on a fresh SQLite database; the settings must point at it before ``src`` is imported."""
+    os.environ["DB_LINK"] = f"sqlite+aiosqlite:///{database}"
+    os.environ.setdefault("TEST_DB_LINK", os.environ["DB_LINK"])
+    os.environ.setdefault("SECRET_KEY", "benchmark-secret-key")
+    # Every simulated librarian signs in from the same address, which the login limiter would shed.
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+
+    from src.api.main import app
+    from src.db import Base, database
+
+    async with database.engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+    return AsyncClient(transport=ASGITransport(app=app), base_url="http://benchmark")
+
+
+async def seed(client: AsyncClient, workers: int, books: int) -> tuple[list[str], list[int], list[int]]:
+    """Create librarians, readers and books through the API, so both modes seed the same way."""
+    run_id = uuid.uuid4().hex[:12]
+    emails = [f"bench-{run_id}-{i}@example.com" for i in range(workers)]
+    for email in emails:
+        response = await client.post("/auth/sign-up", json={"email": email, "password": PASSWORD})
+        response.raise_for_status()
+    client.headers["Authorization"] = f"Bearer {response.json()['access_token']}"
+
+    reader_ids = []
+    for i in range(workers):
+        reader = {"full_name": f"Reader {i}", "email": f"reader-{i}-{emails[i]}"}
+        response = await client.post("/readers/", json=reader)
+        response.raise_for_status()
+        reader_ids.append(response.json()["id"])
+
+    rng = random.Random(run_id)
+    lines = [
+        json.dumps({
+            "title": " ".join(rng.sample(WORDS, 3)).title(),
+            "author": f"{rng.choice(WORDS).title()} {rng.choice(WORDS).title()}",
+            "published_year": rng.randint(1900, 2025),
+            "isbn": f"bench-{run_id}-{i}",
+            "quantity": 1_000_000,
+        })
+        for i in range(books)
+    ]
+    response = await client.post(
+        "/books/bulk", content="\n".join(lines).encode(), headers={"Content-Type": "application/x-ndjson"}
+    )
+    response.raise_for_status()
+
+    book_ids, cursor = [], None
+    while True:
+        params = {"limit": 500, **({"cursor": cursor} if cursor else {})}
+        response = await client.get("/books/", params=params)
+        response.raise_for_status()
+        book_ids += [book["id"] for book in response.json() if (book["isbn"] or "").startswith(f"bench-{run_id}-")]
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            return emails, reader_ids, book_ids
+
+
+async def run(args: argparse.Namespace) -> dict[str, Any]:
+    with tempfile.TemporaryDirectory() as directory:
+        if args.url:
+            client = AsyncClient(base_url=args.url, timeout=args.timeout)
+        else:
+            client = await in_process_client(Path(directory) / "benchmark.db")
+
+        async with client:
+            emails, reader_ids, book_ids = await seed(client, args.concurrency, args.books)
+            recorder = Recorder()
+            workers = [
+                Worker(client, recorder, random.Random(args.seed + i), emails[i], reader_ids[i], book_ids)
+                for i in range(args.concurrency)
+            ]
+            started = time.perf_counter()
+            deadline = started + args.warmup + args.duration
+            tasks = [asyncio.create_task(worker.run(deadline)) for worker in workers]
+            await asyncio.sleep(args.warmup)
+            recorder.recording = True
+            measured_from = time.perf_counter()
+            await asyncio.gather(*tasks)
+            duration = time.perf_counter() - measured_from
+
+    return {
+        "meta": {
+            "mode": "server" if args.url else "in-process",
+            "concurrency": args.concurrency,
+            "duration": round(duration, 3),
+            "books": args.books,
+            "seed": args.seed,
+            "python": platform.python_version(),
+        },
+        "endpoints": recorder.summary(duration),
+    }
+
+
+def compare(results: dict[str, Any], baseline: dict[str, Any], tolerance: float) -> list[str]:
+    """Endpoints whose p95 latency grew, or throughput dropped, by more than ``tolerance``."""
+    regressions = []
+    for endpoint, before in baseline["endpoints"].items():
+        after = results["endpoints"].get(endpoint)
+        if after is None:
+            continue
+        if after["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{endpoint}: p95 {before['p95_ms']} ms -> {after['p95_ms']} ms")
+        if after["rps"] < before["rps"] * (1 - tolerance):
+            regressions.append(f"{endpoint}: {before['rps']} rps -> {after['rps']} rps")
+    return regressions
+
+
+def print_table(results: dict[str, Any]) -> None:
+    print(f"{'endpoint':<42}{'requests':>10}{'errors':>8}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for endpoint, stats in results["endpoints"].items():
+        print(
+            f"{endpoint:<42}{stats['requests']:>10}{stats['errors']:>8}{stats['rps']:>10}"
+            f"{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}"
+        )
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Benchmark a running server instead of the in-process app.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent workers (default: 8).")
+    parser.add_argument("--duration", type=float, default=10, help="Measured seconds (default: 10).")
+    parser.add_argument("--warmup", type=float, default=2, help="Unmeasured seconds before that (default: 2).")
+    parser.add_argument("--books", type=int, default=500, help="Books to seed (default: 500).")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the workers' operation choice.")
+    parser.add_argument("--timeout", type=float, default=30, help="Request timeout in server mode.")
+    parser.add_argument("--output", type=Path, help="Write the results as JSON to this file.")
+    parser.add_argument("--baseline", type=Path, help="Compare with the results stored in this file.")
+    parser.add_argument("--save-baseline", type=Path, help="Store the results as the new baseline.")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.2, help="Allowed relative slowdown of an endpoint (default: 0.2)."
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = parse_args(argv)
+    results = asyncio.run(run(args))
+    print_table(results)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            path.write_text(json.dumps(results, indent=2) + "\n")
+
+    if args.baseline:
+        regressions = compare(results, json.loads(args.baseline.read_text()), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
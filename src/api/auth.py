@@ -1,10 +1,14 @@
 # Python std lib
+import asyncio
+import math
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 
 # Third party
 import jwt
 from jwt.exceptions import InvalidTokenError
-from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi import APIRouter, HTTPException, Request, status, Depends
 from passlib.context import CryptContext
 from pydantic import EmailStr
 from sqlalchemy import select
@@ -14,7 +18,10 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from ..config import settings
 from ..db import get_session
 from ..models import Librarian
-from ..serializers import (AccessToken, RefreshToken, Tokens, LibrarianCreate, LibrarianLogin)
+from ..ratelimit import LoginRateLimiter, get_login_limiter
+from ..revocation import RevocationList, get_revocation_list, revoke
+from ..serializers import (RefreshToken, Tokens, LibrarianCreate, LibrarianLogin)
+from .oauth_scheme import jwt_key
 
 ####################################################################################################
 # SETTINGS
@@ -24,7 +31,20 @@ router = APIRouter(
     prefix="/auth",
     tags=["AUTH"]
 )
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Hashes made with any other cost are reported by ``needs_update`` and rehashed on the next login.
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=settings.BCRYPT_ROUNDS,
+    bcrypt__min_rounds=settings.BCRYPT_ROUNDS,
+    bcrypt__max_rounds=settings.BCRYPT_ROUNDS,
+)
+# bcrypt releases the GIL, so a thread pool spreads hashing over the cores while the event loop
+# keeps serving other requests.
+password_hasher = ThreadPoolExecutor(
+    max_workers=settings.PASSWORD_HASHER_WORKERS,
+    thread_name_prefix="password-hasher",
+)
 
 
 ####################################################################################################
@@ -39,13 +59,27 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 
+async def hash_password_async(plain_password: str) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_hasher, hash_password, plain_password)
+
+
+async def verify_and_update_password(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    """Verify a password off the event loop; also return a new hash if the stored one is outdated."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        password_hasher, pwd_context.verify_and_update, plain_password, hashed_password
+    )
+
+
 def create_refresh_token(data: dict) -> str:
     refresh_token_data = data.copy()
     refresh_token_data.update({
         "type": "refresh",
+        "jti": uuid.uuid4().hex,
         "exp": datetime.now(timezone.utc) + timedelta(minutes=settings.REFRESH_TOKEN_EXPIRE_MINUTES)
     })
-    return jwt.encode(refresh_token_data, settings.get_secret_key, algorithm=settings.JWT_ALGORITHM)
+    return jwt.encode(refresh_token_data, jwt_key, algorithm=settings.JWT_ALGORITHM)
 
 
 def create_access_token(data: dict) -> str:
@@ -54,20 +88,54 @@ def create_access_token(data: dict) -> str:
         "type": "access",
         "exp": datetime.now(timezone.utc) + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     })
-    return jwt.encode(access_token_data, settings.get_secret_key, algorithm=settings.JWT_ALGORITHM)
+    return jwt.encode(access_token_data, jwt_key, algorithm=settings.JWT_ALGORITHM)
 
 
 def create_tokens(data: dict) -> tuple[str, str]:
     return create_refresh_token(data), create_access_token(data)
 
 
+async def enforce_login_rate_limit(request: Request, email: str, limiter: LoginRateLimiter) -> None:
+    """Reject an attempt over the limit of its client IP or email, before any query or hash runs."""
+    client_ip = request.client.host if request.client else "unknown"
+    wait = await limiter.check(client_ip, email)
+    if wait:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many attempts, try again later.",
+            headers={"Retry-After": str(math.ceil(wait))},
+        )
+
+
+def decode_refresh_token(refresh_token: str) -> dict:
+    invalid_credentials = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+    )
+    try:
+        payload = jwt.decode(refresh_token, jwt_key, algorithms=[settings.JWT_ALGORITHM])
+    except InvalidTokenError:
+        raise invalid_credentials
+    if payload.get("sub") is None or payload.get("type") != "refresh" or payload.get("jti") is None:
+        raise invalid_credentials
+    return payload
+
+
+def token_expiry(payload: dict) -> datetime:
+    return datetime.fromtimestamp(payload["exp"], timezone.utc)
+
+
 async def authenticate_user(email: EmailStr, password: str, session: AsyncSession):
     result = await session.execute(select(Librarian).where(Librarian.email == email))
     user = result.scalar_one_or_none()
     if not user:
         return None
-    if not verify_password(password, user.password):
+    is_valid, new_hash = await verify_and_update_password(password, user.password)
+    if not is_valid:
         return None
+    if new_hash is not None:
+        user.password = new_hash
+        await session.commit()
     return user
 
 
@@ -76,13 +144,19 @@ async def authenticate_user(email: EmailStr, password: str, session: AsyncSessio
 ####################################################################################################
 
 @router.post("/sign-up", response_model=Tokens, status_code=status.HTTP_201_CREATED)
-async def sign_up(data: LibrarianCreate, session: AsyncSession = Depends(get_session)) -> Tokens:
+async def sign_up(
+        data: LibrarianCreate,
+        request: Request,
+        session: AsyncSession = Depends(get_session),
+        limiter: LoginRateLimiter = Depends(get_login_limiter),
+) -> Tokens:
+    await enforce_login_rate_limit(request, data.email, limiter)
     result = await session.execute(select(Librarian).where(Librarian.email == data.email))
     user: Librarian | None = result.scalar_one_or_none()
     if user:
         raise HTTPException(status_code=400, detail="User with this username or email already exists")
 
-    hashed_password = hash_password(data.password)
+    hashed_password = await hash_password_async(data.password)
     new_user = Librarian(email=data.email, password=hashed_password)
 
     session.add(new_user)
@@ -94,7 +168,13 @@ async def sign_up(data: LibrarianCreate, session: AsyncSession = Depends(get_ses
 
 
 @router.post("/sign-in", response_model=Tokens, status_code=status.HTTP_200_OK)
-async def sign_in(data: LibrarianLogin, session: AsyncSession = Depends(get_session)) -> Tokens:
+async def sign_in(
+        data: LibrarianLogin,
+        request: Request,
+        session: AsyncSession = Depends(get_session),
+        limiter: LoginRateLimiter = Depends(get_login_limiter),
+) -> Tokens:
+    await enforce_login_rate_limit(request, data.email, limiter)
     incorrect_credentials = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Incorrect email or password",
@@ -107,18 +187,41 @@ async def sign_in(data: LibrarianLogin, session: AsyncSession = Depends(get_sess
     return Tokens(refresh_token=refresh_token, access_token=access_token)
 
 
-@router.post("/token", response_model=AccessToken, status_code=status.HTTP_200_OK)
-async def login_for_access_token(refresh_token: RefreshToken) -> AccessToken:
-    invalid_credentials = HTTPException(
+@router.post("/token", response_model=Tokens, status_code=status.HTTP_200_OK)
+async def login_for_access_token(
+        refresh_token: RefreshToken,
+        session: AsyncSession = Depends(get_session),
+        revocation_list: RevocationList = Depends(get_revocation_list),
+) -> Tokens:
+    payload = decode_refresh_token(refresh_token.refresh_token)
+    reused_token = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
+        detail="Refresh token has already been used or revoked",
     )
-    try:
-        payload = jwt.decode(refresh_token.refresh_token, settings.get_secret_key, algorithms=[settings.JWT_ALGORITHM])
-        user_id: str | None = payload.get("sub")
-        type_: str | None = payload.get("type")
-        if user_id is None or type_ != "refresh":
-            raise invalid_credentials
-        return AccessToken(access_token=create_access_token({"sub": user_id}))
-    except InvalidTokenError:
-        raise invalid_credentials
+    # A refresh token is good for one use: it is revoked here and a new one is issued. A replay
+    # is usually turned away by the revocation list alone; one it does not know about yet, e.g.
+    # a concurrent refresh on another worker, still loses on the unique jti of the insert.
+    if await revocation_list.is_revoked(session, payload["jti"]):
+        raise reused_token
+    if not await revoke(session, payload["jti"], token_expiry(payload)):
+        await session.rollback()
+        revocation_list.add(payload["jti"])
+        raise reused_token
+    await session.commit()
+    revocation_list.add(payload["jti"])
+
+    new_refresh_token, access_token = create_tokens({"sub": payload["sub"]})
+    return Tokens(refresh_token=new_refresh_token, access_token=access_token)
+
+
+@router.post("/revoke", status_code=status.HTTP_204_NO_CONTENT)
+async def revoke_refresh_token(
+        refresh_token: RefreshToken,
+        session: AsyncSession = Depends(get_session),
+        revocation_list: RevocationList = Depends(get_revocation_list),
+) -> None:
+    """Revoke a refresh token, e.g. on sign-out; revoking it again is not an error."""
+    payload = decode_refresh_token(refresh_token.refresh_token)
+    await revoke(session, payload["jti"], token_expiry(payload))
+    await session.commit()
+    revocation_list.add(payload["jti"])
@@ -1,14 +1,32 @@
+# Python std lib
+import asyncio
+import csv
+from typing import Any, AsyncIterator, Literal
+
 # Third party
-from fastapi import APIRouter, HTTPException, Depends, status
-from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, status
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 from sqlalchemy.future import select
 from sqlalchemy.exc import NoResultFound
 
 # Local
-from ..db import get_session
+from ..availability import AvailabilityBroker, format_event, get_availability_broker
+from ..cache import CacheBackend, book_key, get_cache
+from ..config import settings
+from ..db import get_read_session, get_read_session_factory, get_session
 from ..models import Book
-from ..serializers import BookCreate, BookResponse
+from ..search import full_text_search
+from ..serializers import (
+    BookCreate, BookImportError, BookImportResult, BookResponse, BookListAdapter, BookRowListAdapter
+)
+from .conditional import dump_list, dump_rows, json_response, response_columns
+from .exports import DEFAULT_EXPORT_BATCH_SIZE, MAX_EXPORT_BATCH_SIZE, ExportFormat, export_response
 from .oauth_scheme import verify_token
+from .pagination import apply_pagination, split_page
 
 
 ####################################################################################################
@@ -20,6 +38,154 @@ router = APIRouter(
     tags=["BOOKS"],
     dependencies=[Depends(verify_token)]
 )
+BULK_IMPORT_CHUNK_SIZE = 1000
+BULK_IMPORT_MAX_ERRORS = 1000
+BULK_IMPORT_COLUMNS = tuple(BookCreate.model_fields)
+CSV_CONTENT_TYPES = {"text/csv"}
+NDJSON_CONTENT_TYPES = {"application/x-ndjson", "application/ndjson", "application/jsonl"}
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+####################################################################################################
+# CLASSES
+####################################################################################################
+
+class MalformedRecord(ValueError):
+    """A bulk import row that could not even be read; yielded in its place and reported as failed."""
+
+####################################################################################################
+# FUNCTIONS
+####################################################################################################
+
+def decode_line(line: bytes) -> str | MalformedRecord:
+    try:
+        return line.decode("utf-8").rstrip("\r")
+    except UnicodeDecodeError:
+        return MalformedRecord("Row is not valid UTF-8")
+
+
+async def iter_lines(stream: AsyncIterator[bytes]) -> AsyncIterator[str | MalformedRecord]:
+    """Split a streamed request body into text lines without buffering more than one line."""
+    buffer = b""
+    async for chunk in stream:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield decode_line(line)
+    if buffer:
+        yield decode_line(buffer)
+
+
+async def iter_csv_records(
+        lines: AsyncIterator[str | MalformedRecord],
+) -> AsyncIterator[dict[str, str | None] | MalformedRecord]:
+    """Yield CSV records as dicts keyed by the header row; empty cells become ``None``."""
+    header: list[str] | None = None
+    record = ""
+    async for line in lines:
+        if isinstance(line, MalformedRecord):
+            # The rest of a quoted cell that spanned this line is lost with it.
+            record = ""
+            yield line
+            continue
+        record = f"{record}\n{line}" if record else line
+        # An odd number of quotes means a quoted cell continues on the next line.
+        if record.count('"') % 2:
+            continue
+        values = next(csv.reader([record]), [])
+        record = ""
+        if not values:
+            continue
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        yield {name: value if value != "" else None for name, value in zip(header, values)}
+    if record:
+        yield MalformedRecord("Quoted cell is not closed before the end of the file")
+
+
+async def iter_ndjson_records(
+        lines: AsyncIterator[str | MalformedRecord],
+) -> AsyncIterator[str | MalformedRecord]:
+    async for line in lines:
+        if isinstance(line, MalformedRecord) or line.strip():
+            yield line
+
+
+async def stream_availability(
+        broker: AvailabilityBroker,
+        session_factory: async_sessionmaker[AsyncSession],
+        book_ids: set[int] | None,
+) -> AsyncIterator[str]:
+    """
+    Yield availability events until the client goes away.
+
+    The stream subscribes before it reads the current quantities of ``book_ids``, so a change
+    committed in between is sent after the snapshot instead of being lost. A comment line is sent
+    when nothing happened for a while, which keeps proxies from closing an idle connection.
+    """
+    queue = broker.subscribe()
+    try:
+        if book_ids:
+            async with session_factory() as session:
+                snapshot = await session.execute(select(Book.id, Book.quantity).where(Book.id.in_(book_ids)))
+                for book_id, quantity in snapshot.all():
+                    yield format_event(book_id, quantity)
+        while True:
+            try:
+                change = await asyncio.wait_for(queue.get(), settings.AVAILABILITY_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if change is None:
+                # Changes may have been missed; the client's EventSource reconnects for a new snapshot.
+                return
+            book_id, quantity = change
+            if book_ids is None or book_id in book_ids:
+                yield format_event(book_id, quantity)
+    finally:
+        broker.unsubscribe(queue)
+
+
+async def write_books_chunk(session: AsyncSession, books: list[BookCreate]) -> list[int]:
+    """Upsert one chunk of books by ISBN in a single statement (binary COPY on asyncpg)."""
+    # ON CONFLICT can not touch the same row twice in one statement, so the last row of a
+    # duplicated ISBN wins.
+    rows = list({
+        book.isbn if book.isbn is not None else -index: book.model_dump()
+        for index, book in enumerate(books, start=1)
+    }.values())
+    connection = await session.connection()
+    update_columns = [column for column in BULK_IMPORT_COLUMNS if column != "isbn"]
+
+    if connection.dialect.driver == "asyncpg":
+        raw_connection = await connection.get_raw_connection()
+        await session.execute(text(
+            "CREATE TEMP TABLE IF NOT EXISTS books_import ("
+            "title varchar(255), author varchar(255), published_year integer, isbn varchar(255), "
+            "quantity integer) ON COMMIT DELETE ROWS"
+        ))
+        await raw_connection.driver_connection.copy_records_to_table(
+            "books_import",
+            records=[tuple(row[column] for column in BULK_IMPORT_COLUMNS) for row in rows],
+            columns=BULK_IMPORT_COLUMNS,
+        )
+        columns = ", ".join(BULK_IMPORT_COLUMNS)
+        updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in update_columns)
+        result = await session.execute(text(
+            f"INSERT INTO books ({columns}) SELECT {columns} FROM books_import "
+            f"ON CONFLICT (isbn) DO UPDATE SET {updates} RETURNING id"
+        ))
+        return list(result.scalars())
+
+    dialect_insert = postgresql.insert if connection.dialect.name == "postgresql" else sqlite.insert
+    query = dialect_insert(Book).values(rows)
+    query = query.on_conflict_do_update(
+        index_elements=[Book.isbn],
+        set_={column: query.excluded[column] for column in update_columns},
+    )
+    result = await session.execute(query.returning(Book.id))
+    return list(result.scalars())
+
 
 ####################################################################################################
 # ENDPOINTS
@@ -35,34 +201,162 @@ async def create_book(book: BookCreate, session: AsyncSession = Depends(get_sess
     return new_book
 
 
+@router.post("/bulk", response_model=BookImportResult, status_code=status.HTTP_200_OK)
+async def bulk_import_books(
+        request: Request, session: AsyncSession = Depends(get_session), cache: CacheBackend = Depends(get_cache)
+):
+    """Upsert books by ISBN from a streamed CSV or NDJSON body, reporting invalid rows."""
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    lines = iter_lines(request.stream())
+    if content_type in CSV_CONTENT_TYPES:
+        records: AsyncIterator[Any] = iter_csv_records(lines)
+    elif content_type in NDJSON_CONTENT_TYPES:
+        records = iter_ndjson_records(lines)
+    else:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Expected a text/csv or application/x-ndjson body",
+        )
+
+    result = BookImportResult(processed=0, imported=0, failed=0, errors=[])
+    chunk: list[BookCreate] = []
+    async for record in records:
+        result.processed += 1
+        try:
+            if isinstance(record, MalformedRecord):
+                raise record
+            if isinstance(record, str):
+                chunk.append(BookCreate.model_validate_json(record))
+            else:
+                chunk.append(BookCreate.model_validate(record))
+        except (MalformedRecord, ValidationError) as exc:
+            result.failed += 1
+            if len(result.errors) < BULK_IMPORT_MAX_ERRORS:
+                errors = [str(exc)] if isinstance(exc, MalformedRecord) else [
+                    f"{'.'.join(map(str, error['loc']))}: {error['msg']}" if error["loc"] else error["msg"]
+                    for error in exc.errors()
+                ]
+                result.errors.append(BookImportError(row=result.processed, errors=errors))
+            continue
+
+        if len(chunk) >= BULK_IMPORT_CHUNK_SIZE:
+            book_ids = await write_books_chunk(session, chunk)
+            await session.commit()
+            await cache.delete(*map(book_key, book_ids))
+            # Rows repeating an ISBN within the chunk are merged into one book.
+            result.imported += len(book_ids)
+            chunk = []
+
+    if chunk:
+        book_ids = await write_books_chunk(session, chunk)
+        await session.commit()
+        await cache.delete(*map(book_key, book_ids))
+        result.imported += len(book_ids)
+    return result
+
+
+@router.get("/search", response_model=list[BookResponse], status_code=status.HTTP_200_OK)
+async def search_books(
+        request: Request,
+        q: str = Query(..., min_length=1, max_length=255),
+        limit: int = Query(20, ge=1, le=100),
+        session: AsyncSession = Depends(get_read_session),
+):
+    """Full-text search over title, author and description, best matches first."""
+    books = await full_text_search(session, q, limit)
+    return json_response(request, dump_list(BookListAdapter, books))
+
+
+@router.get("/export", response_class=StreamingResponse, status_code=status.HTTP_200_OK)
+async def export_books(
+        export_format: ExportFormat = Query("ndjson", alias="format"),
+        batch_size: int = Query(DEFAULT_EXPORT_BATCH_SIZE, ge=1, le=MAX_EXPORT_BATCH_SIZE),
+        session_factory: async_sessionmaker[AsyncSession] = Depends(get_read_session_factory),
+):
+    """Stream all books as NDJSON or CSV."""
+    query = select(Book).order_by(Book.id)
+    return export_response(session_factory, query, BookResponse, "books", export_format, batch_size)
+
+
+@router.get("/availability/stream", response_class=StreamingResponse, status_code=status.HTTP_200_OK)
+async def stream_books_availability(
+        book_ids: list[int] | None = Query(None, alias="book_id"),
+        broker: AvailabilityBroker = Depends(get_availability_broker),
+        session_factory: async_sessionmaker[AsyncSession] = Depends(get_read_session_factory),
+):
+    """Server-Sent Events with the new quantity of a book each time it changes."""
+    # LISTEN starts before the response does, so a broken bridge is reported with a status code.
+    if broker.bridge is not None:
+        try:
+            await broker.bridge.connection()
+        except Exception as error:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Availability stream is unavailable."
+            ) from error
+    return StreamingResponse(
+        stream_availability(broker, session_factory, set(book_ids) if book_ids else None),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+    )
+
+
 @router.get("/{book_id}", response_model=BookResponse, status_code=status.HTTP_200_OK)
-async def get_book(book_id: int, session: AsyncSession = Depends(get_session)):
+async def get_book(
+        book_id: int,
+        request: Request,
+        session: AsyncSession = Depends(get_session),
+        cache: CacheBackend = Depends(get_cache),
+):
     """Retrieve a book by its ID."""
-    try:
-        result = await session.execute(select(Book).where(Book.id == book_id))
-        book = result.scalar_one()
-        return book
-    except NoResultFound:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Book not found")
+    content = await cache.get(book_key(book_id))
+    if content is None:
+        # Filled from the primary: a lagging replica would keep a stale row cached for the whole TTL.
+        try:
+            result = await session.execute(select(Book).where(Book.id == book_id))
+            book = result.scalar_one()
+        except NoResultFound:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Book not found")
+        content = BookResponse.model_validate(book).model_dump_json().encode()
+        await cache.set(book_key(book_id), content, settings.CACHE_TTL_SECONDS)
+    return json_response(request, content)
 
 
 @router.get("/", response_model=list[BookResponse], status_code=status.HTTP_200_OK)
-async def list_books(skip: int = 0, limit: int = 10, session: AsyncSession = Depends(get_session)):
-    """List all books with pagination."""
-    result = await session.execute(select(Book).offset(skip).limit(limit))
-    books = result.scalars().all()
-    return books
+async def list_books(
+        request: Request,
+        cursor: str | None = None,
+        skip: int | None = Query(None, ge=0),
+        limit: int = Query(10, ge=1),
+        sort: Literal["id", "title", "author"] = "id",
+        session: AsyncSession = Depends(get_read_session),
+):
+    """List all books with keyset (``cursor``) or legacy offset (``skip``) pagination."""
+    columns = response_columns(Book, BookResponse)
+    query = apply_pagination(select(*columns), Book, sort, limit, skip, cursor)
+    result = await session.execute(query)
+    rows, headers = split_page(result.all(), sort, limit)
+    return json_response(request, dump_rows(BookRowListAdapter, rows), headers)
 
 
 @router.put("/{book_id}", response_model=BookResponse, status_code=status.HTTP_200_OK)
-async def update_book(book_id: int, updated_book: BookCreate, session: AsyncSession = Depends(get_session)):
+async def update_book(
+        book_id: int,
+        updated_book: BookCreate,
+        session: AsyncSession = Depends(get_session),
+        cache: CacheBackend = Depends(get_cache),
+        broker: AvailabilityBroker = Depends(get_availability_broker),
+):
     """Update an existing book."""
     try:
         result = await session.execute(select(Book).where(Book.id == book_id))
         book = result.scalar_one()
+        previous_quantity = book.quantity
         for field, value in updated_book.model_dump().items():
             setattr(book, field, value)
         await session.commit()
+        await cache.delete(book_key(book_id))
+        if updated_book.quantity != previous_quantity:
+            await broker.publish([(book_id, updated_book.quantity)])
         await session.refresh(book)
         return book
     except NoResultFound:
@@ -70,13 +364,16 @@ async def update_book(book_id: int, updated_book: BookCreate, session: AsyncSess
 
 
 @router.delete("/{book_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_book(book_id: int, session: AsyncSession = Depends(get_session)):
+async def delete_book(
+        book_id: int, session: AsyncSession = Depends(get_session), cache: CacheBackend = Depends(get_cache)
+):
     """Delete a book by its ID."""
     try:
         result = await session.execute(select(Book).where(Book.id == book_id))
         book = result.scalar_one()
         await session.delete(book)
         await session.commit()
+        await cache.delete(book_key(book_id))
     except NoResultFound:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Book not found")
     return None
\ No newline at end of file
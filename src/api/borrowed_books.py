@@ -1,18 +1,38 @@
 # Python std lib
-from datetime import date
+from collections import Counter, deque
+from datetime import date, timedelta
+from typing import Literal, NoReturn
 
 # Third party
-from fastapi import APIRouter, HTTPException, Depends, status
-from sqlalchemy import func
-from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, status
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy import (
+    Date, Float, Integer, Update, case, insert, literal, null, type_coerce, update
+)
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 from sqlalchemy.future import select
 from sqlalchemy.exc import NoResultFound
+from sqlalchemy.sql.expression import FunctionElement
 
 # Local
-from ..db import get_session
-from ..models import BorrowedBook, Book, Reader
-from ..serializers import BorrowedBookCreate, BorrowedBookResponse
+from ..availability import AvailabilityBroker, get_availability_broker
+from ..cache import CacheBackend, book_key, get_cache
+from ..config import settings
+from ..db import get_read_session, get_read_session_factory, get_session
+from ..models import BorrowedBook, Book, Reader, is_active, is_active_clause
+from ..serializers import (
+    BorrowedBookCheckoutStatus, BorrowedBookCreate, BorrowedBookResponse, BorrowedBookReturnStatus,
+    BorrowedBookRowListAdapter, BorrowedBooksCheckout, BorrowedBooksCheckoutResult, BorrowedBooksReturn,
+    BorrowedBooksReturnResult, OverdueLoanResponse, OverdueLoanRowListAdapter,
+)
+from .conditional import dump_rows, json_response, response_columns
+from .exports import (
+    DEFAULT_COLUMNAR_BATCH_SIZE, DEFAULT_EXPORT_BATCH_SIZE, MAX_COLUMNAR_BATCH_SIZE, MAX_EXPORT_BATCH_SIZE,
+    ColumnarFormat, ExportFormat, columnar_export_response, export_response
+)
 from .oauth_scheme import verify_token
+from .pagination import apply_pagination, split_page
 
 
 ####################################################################################################
@@ -24,92 +44,434 @@ router = APIRouter(
     tags=["BORROWED BOOKS"],
     dependencies=[Depends(verify_token)]
 )
+MAX_ACTIVE_LOANS = 3
+CHECKOUT_ERRORS = {
+    "not_found": (status.HTTP_404_NOT_FOUND, "Book is not found."),
+    "out_of_stock": (status.HTTP_400_BAD_REQUEST, "Book is out of stock."),
+    "limit_reached": (
+        status.HTTP_400_BAD_REQUEST,
+        f"The reader has already taken the maximum number of books ({MAX_ACTIVE_LOANS}) "
+        "and has not returned them.",
+    ),
+}
+
+####################################################################################################
+# CLASSES
+####################################################################################################
+
+class days_between(FunctionElement):
+    """Whole days from the second date argument to the first, on PostgreSQL and SQLite alike."""
+
+    type = Integer()
+    inherit_cache = True
+
+
+@compiles(days_between)
+def compile_days_between(element: days_between, compiler, **kw) -> str:
+    end, start = (compiler.process(clause, **kw) for clause in element.clauses)
+    return f"({end} - {start})"
+
+
+@compiles(days_between, "sqlite")
+def compile_days_between_sqlite(element: days_between, compiler, **kw) -> str:
+    end, start = (compiler.process(clause, **kw) for clause in element.clauses)
+    return f"CAST(julianday({end}) - julianday({start}) AS INTEGER)"
+
+####################################################################################################
+# FUNCTIONS
+####################################################################################################
+
+def release_loan(reader_id: int) -> Update:
+    """Give a reader's loan slot back; a drifted counter is left at zero for ``src.reconcile`` to fix."""
+    return (
+        update(Reader)
+        .where(Reader.id == reader_id, Reader.active_loans > 0)
+        .values(active_loans=Reader.active_loans - 1)
+    )
+
+
+def return_copy(book_id: int) -> Update:
+    return (
+        update(Book)
+        .where(Book.id == book_id)
+        .values(quantity=Book.quantity + 1)
+        .returning(Book.id, Book.quantity)
+    )
+
+
+async def take_loan(session: AsyncSession, borrowed_book: BorrowedBookCreate) -> int:
+    """Take the reader's loan slot and a copy of the book, or roll back; the book's new quantity."""
+    # Taking the slot is one conditional update, which also locks the reader row, so concurrent
+    # checkouts can not race past the limit. Readers are locked before books, here and in the
+    # return paths.
+    slot_query = await session.execute(
+        update(Reader)
+        .where(Reader.id == borrowed_book.reader_id, Reader.active_loans < MAX_ACTIVE_LOANS)
+        .values(active_loans=Reader.active_loans + 1)
+        .returning(Reader.active_loans)
+    )
+    if slot_query.scalar_one_or_none() is None:
+        await raise_checkout_error(session, borrowed_book)
+
+    stock_query = await session.execute(
+        update(Book)
+        .where(Book.id == borrowed_book.book_id, Book.quantity > 0)
+        .values(quantity=Book.quantity - 1)
+        .returning(Book.quantity)
+    )
+    quantity = stock_query.scalar_one_or_none()
+    if quantity is None:
+        await raise_checkout_error(session, borrowed_book)
+    return quantity
+
+
+def checkout_error(reason: str) -> HTTPException:
+    status_code, detail = CHECKOUT_ERRORS[reason]
+    return HTTPException(status_code=status_code, detail=detail)
+
+
+async def raise_checkout_error(session: AsyncSession, borrowed_book: BorrowedBookCreate) -> NoReturn:
+    """Roll a failed checkout back and report the first rule it broke: book, stock, reader, limit."""
+    result = await session.execute(
+        select(
+            select(Book.quantity).where(Book.id == borrowed_book.book_id).scalar_subquery(),
+            select(Reader.id).where(Reader.id == borrowed_book.reader_id).scalar_subquery(),
+        )
+    )
+    book_quantity, reader_id = result.one()
+    await session.rollback()
+    if book_quantity is None:
+        raise checkout_error("not_found")
+    if book_quantity <= 0:
+        raise checkout_error("out_of_stock")
+    if reader_id is None:
+        raise HTTPException(status_code=404, detail="Reader is not found.")
+    raise checkout_error("limit_reached")
+
 
 ####################################################################################################
 # ENDPOINTS
 ####################################################################################################
 
 @router.post("/", response_model=BorrowedBookResponse, status_code=status.HTTP_201_CREATED)
-async def create_borrowed_book(borrowed_book: BorrowedBookCreate, session: AsyncSession = Depends(get_session)):
+async def create_borrowed_book(
+        borrowed_book: BorrowedBookCreate,
+        session: AsyncSession = Depends(get_session),
+        cache: CacheBackend = Depends(get_cache),
+        broker: AvailabilityBroker = Depends(get_availability_broker),
+):
     """Record a new borrowed book."""
-    book_query = await session.execute(select(Book).where(Book.id == borrowed_book.book_id))
-    book = book_query.scalar_one_or_none()
-    if not book:
-        raise HTTPException(status_code=404, detail="Book is not found.")
+    if borrowed_book.return_date is not None:
+        raise HTTPException(status_code=400, detail="A new loan can not have a return date.")
+    quantity = await take_loan(session, borrowed_book)
+
+    new_borrowed_book = BorrowedBook(**borrowed_book.model_dump())
+    session.add(new_borrowed_book)
+    await session.commit()
+    await cache.delete(book_key(borrowed_book.book_id))
+    await broker.publish([(borrowed_book.book_id, quantity)])
+
+    return new_borrowed_book
 
-    if book.quantity <= 0:
-        raise HTTPException(status_code=400, detail="Book is out of stock.")
 
-    reader_query = await session.execute(select(Reader).where(Reader.id == borrowed_book.reader_id))
-    reader = reader_query.scalar_one_or_none()
-    if not reader:
+@router.post("/checkout", response_model=BorrowedBooksCheckoutResult, status_code=status.HTTP_201_CREATED)
+async def checkout_borrowed_books(
+        data: BorrowedBooksCheckout,
+        session: AsyncSession = Depends(get_session),
+        cache: CacheBackend = Depends(get_cache),
+        broker: AvailabilityBroker = Depends(get_availability_broker),
+):
+    """Lend several books to one reader in one transaction."""
+    # The reader and the books are locked up front (readers first, as everywhere), then the loans
+    # are decided here and written with one statement per table, whatever the number of books.
+    active_loans = await session.scalar(
+        select(Reader.active_loans).where(Reader.id == data.reader_id).with_for_update()
+    )
+    stock_query = await session.execute(
+        select(Book.id, Book.quantity).where(Book.id.in_(set(data.book_ids))).with_for_update()
+    )
+    stock = dict(stock_query.all())
+
+    lent: Counter[int] = Counter()
+    statuses = []
+    for book_id in data.book_ids:
+        if book_id not in stock:
+            statuses.append("not_found")
+        elif stock[book_id] - lent[book_id] <= 0:
+            statuses.append("out_of_stock")
+        elif active_loans is not None and active_loans + sum(lent.values()) >= MAX_ACTIVE_LOANS:
+            statuses.append("limit_reached")
+        else:
+            statuses.append("borrowed")
+            lent[book_id] += 1
+
+    if active_loans is None:
+        # Same order as a single checkout: a missing or lent out book is reported before the reader.
+        await session.rollback()
+        book_failures = [reason for reason in statuses if reason in ("not_found", "out_of_stock")]
+        if data.atomic and book_failures:
+            raise checkout_error(book_failures[0])
         raise HTTPException(status_code=404, detail="Reader is not found.")
 
-    borrowed_books_query = await session.execute(
-        select(BorrowedBook).where(
-            BorrowedBook.reader_id == borrowed_book.reader_id,
-            (BorrowedBook.return_date.is_(None) | (BorrowedBook.return_date > func.current_date()))
+    failures = [reason for reason in statuses if reason != "borrowed"]
+    if not lent or (data.atomic and failures):
+        await session.rollback()
+        if data.atomic:
+            raise checkout_error(failures[0])
+        # Nothing was created, but the reason of every book is still worth sending.
+        result = BorrowedBooksCheckoutResult(
+            borrowed=0,
+            results=[
+                BorrowedBookCheckoutStatus(book_id=book_id, status=reason)
+                for book_id, reason in zip(data.book_ids, statuses)
+            ],
         )
+        return JSONResponse(result.model_dump(mode="json"), status_code=status.HTTP_409_CONFLICT)
+
+    stock_query = await session.execute(
+        update(Book)
+        .where(Book.id.in_(lent))
+        .values(quantity=Book.quantity - case(lent, value=Book.id))
+        .returning(Book.id, Book.quantity)
+        .execution_options(synchronize_session=False)
     )
+    quantities = stock_query.all()
+    await session.execute(
+        update(Reader)
+        .where(Reader.id == data.reader_id)
+        .values(active_loans=Reader.active_loans + sum(lent.values()))
+        .execution_options(synchronize_session=False)
+    )
+    # Loans only differ by book, so they are matched back by book_id: asking for RETURNING in
+    # parameter order would make some drivers insert the rows one by one.
+    new_loans = await session.scalars(
+        insert(BorrowedBook).returning(BorrowedBook),
+        [
+            {"reader_id": data.reader_id, "book_id": book_id, "borrowed_date": data.borrowed_date}
+            for book_id, reason in zip(data.book_ids, statuses)
+            if reason == "borrowed"
+        ],
+    )
+    loans: dict[int, deque[BorrowedBook]] = {}
+    for loan in sorted(new_loans.all(), key=lambda loan: loan.id):
+        loans.setdefault(loan.book_id, deque()).append(loan)
+    await session.commit()
+    await cache.delete(*(book_key(book_id) for book_id in lent))
+    await broker.publish(quantities)
 
-    borrowed_books_count = len(borrowed_books_query.scalars().all())
-    if borrowed_books_count >= 3:
-        raise HTTPException(
-            status_code=400,
-            detail="The reader has already taken the maximum number of books (3) and has not returned them.",
-        )
+    return BorrowedBooksCheckoutResult(
+        borrowed=sum(lent.values()),
+        results=[
+            BorrowedBookCheckoutStatus(
+                book_id=book_id,
+                status=reason,
+                loan=BorrowedBookResponse.model_validate(loans[book_id].popleft()) if reason == "borrowed" else None,
+            )
+            for book_id, reason in zip(data.book_ids, statuses)
+        ],
+    )
 
-    book.quantity -= 1
-    session.add(book)
 
-    new_borrowed_book = BorrowedBook(**borrowed_book.model_dump())
-    session.add(new_borrowed_book)
+@router.post("/return", response_model=BorrowedBooksReturnResult, status_code=status.HTTP_200_OK)
+async def return_borrowed_books(
+        data: BorrowedBooksReturn,
+        session: AsyncSession = Depends(get_session),
+        cache: CacheBackend = Depends(get_cache),
+        broker: AvailabilityBroker = Depends(get_availability_broker),
+):
+    """Return a stack of borrowed books in one transaction."""
+    ids = list(dict.fromkeys(data.ids))
+    closed = await session.execute(
+        update(BorrowedBook)
+        .where(BorrowedBook.id.in_(ids), is_active_clause(), BorrowedBook.borrowed_date <= data.return_date)
+        .values(return_date=data.return_date)
+        .returning(BorrowedBook.id, BorrowedBook.reader_id, BorrowedBook.book_id)
+        .execution_options(synchronize_session=False)
+    )
+    returned = closed.all()
+    statuses = {loan_id: "returned" for loan_id, _, _ in returned}
+
+    rest = [loan_id for loan_id in ids if loan_id not in statuses]
+    if rest:
+        # Still open after the update means the loan started after the return date.
+        existing = await session.execute(
+            select(BorrowedBook.id, is_active_clause()).where(BorrowedBook.id.in_(rest))
+        )
+        statuses.update(
+            {loan_id: "before_borrowed_date" if active else "already_returned" for loan_id, active in existing}
+        )
+
+    # One statement per table, each adding up all the loans of a row; readers before books.
+    if returned:
+        per_reader = Counter(reader_id for _, reader_id, _ in returned)
+        released = case(per_reader, value=Reader.id)
+        await session.execute(
+            update(Reader)
+            .where(Reader.id.in_(per_reader))
+            .values(active_loans=case((Reader.active_loans > released, Reader.active_loans - released), else_=0))
+            .execution_options(synchronize_session=False)
+        )
+        per_book = Counter(book_id for _, _, book_id in returned)
+        stock_query = await session.execute(
+            update(Book)
+            .where(Book.id.in_(per_book))
+            .values(quantity=Book.quantity + case(per_book, value=Book.id))
+            .returning(Book.id, Book.quantity)
+            .execution_options(synchronize_session=False)
+        )
+        quantities = stock_query.all()
     await session.commit()
-    await session.refresh(new_borrowed_book)
+    if returned:
+        await cache.delete(*(book_key(book_id) for book_id in per_book))
+        await broker.publish(quantities)
+
+    return BorrowedBooksReturnResult(
+        returned=len(returned),
+        results=[
+            BorrowedBookReturnStatus(id=loan_id, status=statuses.get(loan_id, "not_found")) for loan_id in ids
+        ],
+    )
 
-    return new_borrowed_book
+
+@router.get("/export", response_class=StreamingResponse, status_code=status.HTTP_200_OK)
+async def export_borrowed_books(
+        export_format: ExportFormat = Query("ndjson", alias="format"),
+        batch_size: int = Query(DEFAULT_EXPORT_BATCH_SIZE, ge=1, le=MAX_EXPORT_BATCH_SIZE),
+        session_factory: async_sessionmaker[AsyncSession] = Depends(get_read_session_factory),
+):
+    """Stream all borrowed books as NDJSON or CSV."""
+    query = select(BorrowedBook).order_by(BorrowedBook.id)
+    return export_response(
+        session_factory, query, BorrowedBookResponse, "borrowed_books", export_format, batch_size
+    )
+
+
+@router.get("/export.{columnar_format}", response_class=StreamingResponse, status_code=status.HTTP_200_OK)
+async def export_loan_history(
+        columnar_format: ColumnarFormat,
+        borrowed_from: date | None = None,
+        borrowed_to: date | None = None,
+        batch_size: int = Query(DEFAULT_COLUMNAR_BATCH_SIZE, ge=1, le=MAX_COLUMNAR_BATCH_SIZE),
+        session_factory: async_sessionmaker[AsyncSession] = Depends(get_read_session_factory),
+):
+    """Stream the loan history with book and reader details as Arrow IPC or Parquet."""
+    query = (
+        select(
+            BorrowedBook.id,
+            BorrowedBook.borrowed_date,
+            BorrowedBook.return_date,
+            BorrowedBook.reader_id,
+            Reader.full_name.label("reader_full_name"),
+            BorrowedBook.book_id,
+            Book.title.label("book_title"),
+            Book.author.label("book_author"),
+        )
+        .join(Reader, Reader.id == BorrowedBook.reader_id)
+        .join(Book, Book.id == BorrowedBook.book_id)
+        .order_by(BorrowedBook.id)
+    )
+    if borrowed_from is not None:
+        query = query.where(BorrowedBook.borrowed_date >= borrowed_from)
+    if borrowed_to is not None:
+        query = query.where(BorrowedBook.borrowed_date <= borrowed_to)
+    return columnar_export_response(session_factory, query, "loan_history", columnar_format, batch_size)
+
+
+@router.get("/overdue", response_model=list[OverdueLoanResponse], status_code=status.HTTP_200_OK)
+async def list_overdue_loans(
+        request: Request,
+        cursor: str | None = None,
+        limit: int = Query(100, ge=1, le=1000),
+        loan_days: int = Query(settings.LOAN_PERIOD_DAYS, ge=1),
+        fine_per_day: float | None = Query(None, ge=0),
+        session: AsyncSession = Depends(get_read_session),
+):
+    """List open loans older than ``loan_days``, oldest first, with days overdue and the fine."""
+    # The cutoff is bound from here, so the filter is a plain range on the partial index of open loans.
+    today = date.today()
+    days_overdue = days_between(literal(today, Date), BorrowedBook.borrowed_date) - loan_days
+    fine = null() if fine_per_day is None else days_overdue * literal(fine_per_day, Float)
+    query = select(
+        *response_columns(BorrowedBook, BorrowedBookResponse),
+        days_overdue.label("days_overdue"),
+        type_coerce(fine, Float).label("fine"),
+    ).where(
+        is_active_clause(),
+        BorrowedBook.borrowed_date < today - timedelta(days=loan_days),
+    )
+    query = apply_pagination(query, BorrowedBook, "borrowed_date", limit, None, cursor)
+    result = await session.execute(query)
+    rows, headers = split_page(result.all(), "borrowed_date", limit)
+    return json_response(request, dump_rows(OverdueLoanRowListAdapter, rows), headers)
 
 
 @router.get("/{borrowed_book_id}", response_model=BorrowedBookResponse, status_code=status.HTTP_200_OK)
-async def get_borrowed_book(borrowed_book_id: int, session: AsyncSession = Depends(get_session)):
+async def get_borrowed_book(
+        borrowed_book_id: int, request: Request, session: AsyncSession = Depends(get_read_session)
+):
     """Retrieve a borrowed book by its ID."""
     try:
         result = await session.execute(select(BorrowedBook).where(BorrowedBook.id == borrowed_book_id))
         borrowed_book = result.scalar_one()
-        return borrowed_book
     except NoResultFound:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Borrowed book not found")
+    content = BorrowedBookResponse.model_validate(borrowed_book).model_dump_json().encode()
+    return json_response(request, content)
 
 
 @router.get("/", response_model=list[BorrowedBookResponse], status_code=status.HTTP_200_OK)
-async def list_borrowed_books(skip: int = 0, limit: int = 10, session: AsyncSession = Depends(get_session)):
-    """List all borrowed books with pagination."""
-    result = await session.execute(select(BorrowedBook).offset(skip).limit(limit))
-    borrowed_books = result.scalars().all()
-    return borrowed_books
+async def list_borrowed_books(
+        request: Request,
+        cursor: str | None = None,
+        skip: int | None = Query(None, ge=0),
+        limit: int = Query(10, ge=1),
+        sort: Literal["id", "reader_id", "book_id"] = "id",
+        session: AsyncSession = Depends(get_read_session),
+):
+    """List all borrowed books with keyset (``cursor``) or legacy offset (``skip``) pagination."""
+    columns = response_columns(BorrowedBook, BorrowedBookResponse)
+    query = apply_pagination(select(*columns), BorrowedBook, sort, limit, skip, cursor)
+    result = await session.execute(query)
+    rows, headers = split_page(result.all(), sort, limit)
+    return json_response(request, dump_rows(BorrowedBookRowListAdapter, rows), headers)
 
 
 @router.put("/{borrowed_book_id}", response_model=BorrowedBookResponse, status_code=status.HTTP_200_OK)
 async def update_borrowed_book(
-        borrowed_book_id: int, updated_borrowed_book: BorrowedBookCreate, session: AsyncSession = Depends(get_session)
+        borrowed_book_id: int,
+        updated_borrowed_book: BorrowedBookCreate,
+        session: AsyncSession = Depends(get_session),
+        cache: CacheBackend = Depends(get_cache),
+        broker: AvailabilityBroker = Depends(get_availability_broker),
 ):
     """Update a borrowed book record."""
     try:
-        result = await session.execute(select(BorrowedBook).where(BorrowedBook.id == borrowed_book_id))
+        result = await session.execute(
+            select(BorrowedBook).where(BorrowedBook.id == borrowed_book_id).with_for_update()
+        )
         borrowed_book = result.scalar_one()
 
-        if updated_borrowed_book.return_date and (
-                updated_borrowed_book.return_date <= date.today()
-        ):
-            book_query = await session.execute(select(Book).where(Book.id == borrowed_book.book_id))
-            book = book_query.scalar_one_or_none()
-            if book:
-                book.quantity += 1
-                session.add(book)
+        # The slot and the copy only move when the loan changes between active and returned, or
+        # moves to another reader or book, so saving a loan again does not count it twice.
+        was_active = is_active(borrowed_book.return_date)
+        now_active = is_active(updated_borrowed_book.return_date)
+        moved = (borrowed_book.reader_id, borrowed_book.book_id) != (
+            updated_borrowed_book.reader_id, updated_borrowed_book.book_id
+        )
+        quantities: dict[int, int] = {}
+        if was_active and (moved or not now_active):
+            await session.execute(release_loan(borrowed_book.reader_id))
+            stock_query = await session.execute(return_copy(borrowed_book.book_id))
+            quantities.update(stock_query.all())
+        if now_active and (moved or not was_active):
+            quantities[updated_borrowed_book.book_id] = await take_loan(session, updated_borrowed_book)
 
         for field, value in updated_borrowed_book.model_dump().items():
             setattr(borrowed_book, field, value)
         await session.commit()
+        if quantities:
+            await cache.delete(*(book_key(book_id) for book_id in quantities))
+            await broker.publish(quantities.items())
         await session.refresh(borrowed_book)
         return borrowed_book
 
@@ -118,13 +480,29 @@ async def update_borrowed_book(
 
 
 @router.delete("/{borrowed_book_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_borrowed_book(borrowed_book_id: int, session: AsyncSession = Depends(get_session)):
+async def delete_borrowed_book(
+        borrowed_book_id: int,
+        session: AsyncSession = Depends(get_session),
+        cache: CacheBackend = Depends(get_cache),
+        broker: AvailabilityBroker = Depends(get_availability_broker),
+):
     """Delete a borrowed book record by its ID."""
     try:
-        result = await session.execute(select(BorrowedBook).where(BorrowedBook.id == borrowed_book_id))
+        # Locked like in update_borrowed_book, so a concurrent return can not release the loan twice.
+        result = await session.execute(
+            select(BorrowedBook).where(BorrowedBook.id == borrowed_book_id).with_for_update()
+        )
         borrowed_book = result.scalar_one()
+        quantities: list[tuple[int, int]] = []
+        if is_active(borrowed_book.return_date):
+            await session.execute(release_loan(borrowed_book.reader_id))
+            stock_query = await session.execute(return_copy(borrowed_book.book_id))
+            quantities = stock_query.all()
         await session.delete(borrowed_book)
         await session.commit()
+        if quantities:
+            await cache.delete(*(book_key(book_id) for book_id, _ in quantities))
+            await broker.publish(quantities)
     except NoResultFound:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Borrowed book not found")
     return None
\ No newline at end of file
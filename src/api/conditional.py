@@ -0,0 +1,47 @@
+# Python std lib
+import hashlib
+from typing import Any, Mapping, Sequence
+
+# Third party
+from fastapi import Request, Response, status
+from pydantic import BaseModel, TypeAdapter
+from sqlalchemy import Row
+
+####################################################################################################
+# FUNCTIONS
+####################################################################################################
+
+def make_etag(content: bytes) -> str:
+    """Strong ETag: a hash of the exact response body."""
+    return f'"{hashlib.blake2b(content, digest_size=16).hexdigest()}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    # If-None-Match uses the weak comparison, so a W/ prefix on the client side is ignored.
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+
+
+def dump_list(adapter: TypeAdapter, items: Sequence[Any]) -> bytes:
+    return adapter.dump_json(adapter.validate_python(items, from_attributes=True))
+
+
+def response_columns(model: Any, schema: type[BaseModel]) -> list[Any]:
+    """The columns of ``model`` that ``schema`` returns, to select rows instead of whole entities."""
+    return [getattr(model, name) for name in schema.model_fields]
+
+
+def dump_rows(adapter: TypeAdapter, rows: Sequence[Row]) -> bytes:
+    """Serialize rows of ``response_columns`` in one pass, with a ``row_list_adapter``."""
+    return adapter.dump_json([row._asdict() for row in rows])
+
+
+def json_response(request: Request, content: bytes, headers: Mapping[str, str] | None = None) -> Response:
+    """Send ``content`` with its ETag, or an empty ``304`` if the client already holds that version."""
+    headers = {**(headers or {}), "ETag": make_etag(content)}
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=content, media_type="application/json", headers=headers)
@@ -0,0 +1,41 @@
+# Third party
+from fastapi import APIRouter, HTTPException, status
+from fastapi.responses import JSONResponse
+
+# Local
+from ..db import database, pool_stats
+from ..serializers import PoolStatsResponse, ReadinessResponse
+
+####################################################################################################
+# SETTINGS
+####################################################################################################
+
+router = APIRouter(
+    prefix="/health",
+    tags=["HEALTH"]
+)
+
+####################################################################################################
+# ENDPOINTS
+####################################################################################################
+
+@router.get("/pool", response_model=PoolStatsResponse, status_code=status.HTTP_200_OK)
+async def get_pool_stats():
+    """Live connection pool usage of this worker."""
+    # Reading the engine of a stopped database would start it again.
+    if not database.started:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Database is not started.")
+    return PoolStatsResponse(
+        primary=pool_stats(database.engine.pool),
+        replicas=[pool_stats(replica.pool) for replica in database.replica_engines],
+    )
+
+
+@router.get("/ready", response_model=ReadinessResponse, status_code=status.HTTP_200_OK)
+async def get_readiness():
+    """503 until this worker has warmed up its connection pools, for load balancer readiness probes."""
+    if not database.ready:
+        return JSONResponse(
+            ReadinessResponse(status="warming_up").model_dump(), status_code=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+    return ReadinessResponse(status="ready")
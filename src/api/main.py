@@ -1,36 +1,104 @@
+# Python std lib
+import asyncio
+import logging
+from contextlib import asynccontextmanager, suppress
+from typing import AsyncIterator
+
 # Third party
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from sqlalchemy import select
 
 # Local
+from ..availability import availability_broker
+from ..config import settings
+from ..db import database
+from ..models import Book, BorrowedBook, Reader
 from .auth import router as auth_router
 from .books import router as books_router
 from .readers import router as readers_router
 from .borrowed_books import router as borrowed_books_router
+from .health import router as health_router
+from .metrics import QUERY_COUNT_HEADER, QUERY_TIME_HEADER, MetricsMiddleware, QueryBudgetMiddleware
+from .metrics import router as metrics_router
+from .pagination import NEXT_CURSOR_HEADER
 
 ####################################################################################################
 # SETTINGS
 ####################################################################################################
 
-app = FastAPI()
+logger = logging.getLogger(__name__)
+
 origins = [
     "http://localhost",
     "http://localhost:8000",
 ]
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+# The hottest lookups, prepared on every warmed connection; the values do not matter.
+WARMUP_QUERIES = (
+    select(Book).where(Book.id == 0),
+    select(Reader).where(Reader.id == 0),
+    select(BorrowedBook).where(BorrowedBook.id == 0),
 )
+WARMUP_MAX_RETRY_DELAY = 30
+
+####################################################################################################
+# FUNCTIONS
+####################################################################################################
+
+async def warm_up_database() -> None:
+    """Warm the pools, retrying while the database is unreachable; the worker is not ready until then."""
+    delay = 1.0
+    while True:
+        try:
+            await database.warm_up(settings.DB_WARMUP_CONNECTIONS, WARMUP_QUERIES)
+            return
+        except Exception:
+            logger.exception("Database warm-up failed, retrying in %.0f s", delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, WARMUP_MAX_RETRY_DELAY)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    # Runs in every worker after the fork, so no engine or connection is shared between processes.
+    # Requests are served while the pools warm up; /health/ready tells when they are.
+    database.start()
+    warm_up = asyncio.create_task(warm_up_database())
+    try:
+        yield
+    finally:
+        warm_up.cancel()
+        with suppress(asyncio.CancelledError):
+            await warm_up
+        if availability_broker.bridge is not None:
+            await availability_broker.bridge.close()
+        await database.dispose()
+
+
+def create_app() -> FastAPI:
+    app = FastAPI(lifespan=lifespan)
+
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=origins,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=[NEXT_CURSOR_HEADER, "ETag", QUERY_COUNT_HEADER, QUERY_TIME_HEADER],
+    )
+    app.add_middleware(QueryBudgetMiddleware)
+    app.add_middleware(MetricsMiddleware)
+
+    app.include_router(auth_router)
+    app.include_router(books_router)
+    app.include_router(readers_router)
+    app.include_router(borrowed_books_router)
+    app.include_router(health_router)
+    app.include_router(metrics_router)
+    return app
 
 ####################################################################################################
-# ROUTERS
+# APP
 ####################################################################################################
 
-app.include_router(auth_router)
-app.include_router(books_router)
-app.include_router(readers_router)
-app.include_router(borrowed_books_router)
\ No newline at end of file
+app = create_app()
@@ -0,0 +1,174 @@
+# Python std lib
+import logging
+import time
+from typing import Iterator
+
+# Third party
+from fastapi import APIRouter, Response
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Local
+from ..availability import availability_broker
+from ..cache import MemoryCache, entity_cache
+from ..config import settings
+from ..db import database, pool_stats
+from ..metrics import (
+    HTTP_LATENCY, HTTP_REQUESTS, QueryBudgetExceeded, QueryStats, query_stats, render_metrics, render_samples
+)
+from .oauth_scheme import token_cache
+
+####################################################################################################
+# SETTINGS
+####################################################################################################
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+QUERY_COUNT_HEADER = "X-DB-Query-Count"
+QUERY_TIME_HEADER = "X-DB-Time-Ms"
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(
+    tags=["HEALTH"]
+)
+
+####################################################################################################
+# MIDDLEWARE
+####################################################################################################
+
+class MetricsMiddleware:
+    """
+    Records the count and latency of every HTTP request.
+
+    Requests are labelled with the route template (``/books/{book_id}``), not the raw path, so
+    the number of series does not grow with the ids in the URLs. A plain ASGI middleware, it adds
+    nothing to streamed response bodies.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            route_path = getattr(route, "path", "unmatched")
+            HTTP_REQUESTS.inc((scope["method"], route_path, str(status_code)))
+            HTTP_LATENCY.observe(time.perf_counter() - started, (scope["method"], route_path))
+
+
+class QueryBudgetMiddleware:
+    """
+    Counts the SQL statements and DB time of every request and checks them against its budget.
+
+    The check runs when the response starts, so it covers everything the handler executed, and a
+    strict budget (in tests) turns into an error instead of a response. Statements repeated
+    ``DB_REPEATED_QUERY_THRESHOLD`` times or more are logged as a likely N+1 pattern.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats()
+
+        async def send_with_stats(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                check_query_budget(route_key(scope), stats)
+                if settings.DEBUG:
+                    headers = MutableHeaders(scope=message)
+                    headers.append(QUERY_COUNT_HEADER, str(stats.count))
+                    headers.append(QUERY_TIME_HEADER, f"{stats.seconds * 1000:.2f}")
+            await send(message)
+
+        token = query_stats.set(stats)
+        try:
+            await self.app(scope, receive, send_with_stats)
+        finally:
+            query_stats.reset(token)
+            for statement, count in stats.repeated(settings.DB_REPEATED_QUERY_THRESHOLD).items():
+                logger.warning(
+                    "Possible N+1 in %s: statement executed %d times: %s", route_key(scope), count, statement
+                )
+
+####################################################################################################
+# FUNCTIONS
+####################################################################################################
+
+def route_key(scope: Scope) -> str:
+    return f"{scope['method']} {getattr(scope.get('route'), 'path', 'unmatched')}"
+
+
+def check_query_budget(key: str, stats: QueryStats) -> None:
+    budget = settings.DB_QUERY_BUDGETS.get(key)
+    if budget is None or stats.count <= budget:
+        return
+    message = f"{key} executed {stats.count} SQL statements, the budget is {budget}."
+    if settings.DB_QUERY_BUDGET_STRICT:
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+
+
+def state_metrics() -> Iterator[str]:
+    """Pool and cache counters of this worker, read at scrape time."""
+    pools = {}
+    # Reading the engine of a stopped database would start it again.
+    if database.started:
+        pools[("primary",)] = pool_stats(database.engine.pool)
+        pools.update(
+            {(f"replica-{i}",): pool_stats(replica.pool) for i, replica in enumerate(database.replica_engines)}
+        )
+    for name, key, kind, documentation in (
+        ("db_pool_checked_out", "checked_out", "gauge", "Connections currently checked out of the pool."),
+        ("db_pool_overflow", "overflow", "gauge", "Connections opened above the pool size."),
+        ("db_pool_waiters", "waiters", "gauge", "Callers waiting for a pooled connection."),
+        ("db_pool_acquire_total", "acquire_count", "counter", "Connections handed out by the pool."),
+        ("db_pool_acquire_seconds_total", "acquire_seconds_total", "counter", "Time spent acquiring connections."),
+    ):
+        samples = {labels: stats[key] for labels, stats in pools.items()}
+        yield from render_samples(name, kind, documentation, ("pool",), samples)
+
+    caches = {("token",): token_cache}
+    if isinstance(entity_cache, MemoryCache):
+        caches[("entity",)] = entity_cache
+    for result in ("hits", "misses"):
+        samples = {labels: getattr(cache, result) for labels, cache in caches.items()}
+        yield from render_samples(f"cache_{result}_total", "counter", f"Cache {result}.", ("cache",), samples)
+
+    yield from render_samples(
+        "availability_subscribers", "gauge", "Open availability streams.", (), {(): availability_broker.subscribers}
+    )
+    yield from render_samples(
+        "availability_events_dropped_total",
+        "counter",
+        "Availability events dropped for slow subscribers.",
+        (),
+        {(): availability_broker.dropped},
+    )
+
+####################################################################################################
+# ENDPOINTS
+####################################################################################################
+
+@router.get("/metrics", response_class=Response)
+async def get_metrics():
+    """Metrics of this worker in the Prometheus text format."""
+    return Response(content=render_metrics(state_metrics()), media_type=PROMETHEUS_CONTENT_TYPE)
@@ -1,3 +1,8 @@
+# Python std lib
+import base64
+import time
+from collections import OrderedDict
+
 # Third party
 import jwt
 from jwt.exceptions import InvalidTokenError
@@ -8,13 +13,75 @@ from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from ..config import settings
 from ..serializers import TokenData
 
+####################################################################################################
+# CLASSES
+####################################################################################################
+
+class TokenCache:
+    """
+    Bounded LRU of verified access tokens.
+
+    An entry lives until the ``exp`` of its token, so a cached token is never accepted after it
+    would have been rejected by ``jwt.decode``. Only used from the event loop, hence no locking.
+    """
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[float, TokenData]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, token: str) -> TokenData | None:
+        entry = self._entries.get(token)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, token_data = entry
+        if expires_at <= time.time():
+            del self._entries[token]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(token)
+        self.hits += 1
+        return token_data
+
+    def set(self, token: str, token_data: TokenData, expires_at: float) -> None:
+        if self.maxsize <= 0:
+            return
+        self._entries[token] = (expires_at, token_data)
+        self._entries.move_to_end(token)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+####################################################################################################
+# SETTINGS
+####################################################################################################
+
 oauth2_scheme = HTTPBearer(auto_error=True)
+# Prepared once, so neither the algorithm lookup nor the key preparation run per token.
+jwt_key = jwt.PyJWK(
+    {"kty": "oct", "k": base64.urlsafe_b64encode(settings.get_secret_key.encode()).rstrip(b"=").decode()},
+    algorithm=settings.JWT_ALGORITHM,
+)
+token_cache = TokenCache(maxsize=settings.TOKEN_CACHE_SIZE)
 
 ####################################################################################################
 # FUNCTIONS
 ####################################################################################################
 
-def verify_token(access_token: HTTPAuthorizationCredentials = Depends(oauth2_scheme)) -> TokenData:
+async def verify_token(access_token: HTTPAuthorizationCredentials = Depends(oauth2_scheme)) -> TokenData:
+    token_data = token_cache.get(access_token.credentials)
+    if token_data is not None:
+        return token_data
+
     invalid_token = HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid token",
@@ -22,12 +89,15 @@ def verify_token(access_token: HTTPAuthorizationCredentials = Depends(oauth2_sch
         )
 
     try:
-        payload = jwt.decode(access_token.credentials, settings.get_secret_key, algorithms=[settings.JWT_ALGORITHM])
+        payload = jwt.decode(access_token.credentials, jwt_key, algorithms=[settings.JWT_ALGORITHM])
         user_id: str | None = payload.get("sub")
         type_: str | None = payload.get("type")
         if user_id is None or type_ != "access":
             raise invalid_token
 
-        return TokenData(sub=user_id)
+        token_data = TokenData(sub=user_id)
+        if "exp" in payload:
+            token_cache.set(access_token.credentials, token_data, payload["exp"])
+        return token_data
     except InvalidTokenError:
-        raise invalid_token
\ No newline at end of file
+        raise invalid_token
@@ -0,0 +1,92 @@
+# Python std lib
+import base64
+import binascii
+import datetime
+import json
+from typing import Any, Sequence
+
+# Third party
+from fastapi import HTTPException, status
+from sqlalchemy import Select, tuple_
+
+####################################################################################################
+# SETTINGS
+####################################################################################################
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+####################################################################################################
+# FUNCTIONS
+####################################################################################################
+
+def encode_cursor(sort_key: str, value: Any, id_: int) -> str:
+    """Pack the last seen ``(sort_key, id)`` pair into an opaque url-safe token."""
+    if isinstance(value, datetime.date):
+        value = value.isoformat()
+    raw = json.dumps([sort_key, value, id_], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def decode_cursor(cursor: str, sort_key: str, python_type: type | None = None) -> tuple[Any, int]:
+    """Unpack a cursor of ``sort_key``; dates travel as ISO strings and are parsed back for ``python_type``."""
+    invalid_cursor = HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        key, value, id_ = json.loads(raw)
+        if python_type is datetime.date:
+            value = datetime.date.fromisoformat(value)
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+        raise invalid_cursor
+    # bool is an int to isinstance, but never a valid key.
+    if key != sort_key or not isinstance(id_, int) or isinstance(id_, bool):
+        raise invalid_cursor
+    if python_type is not None and (not isinstance(value, python_type) or isinstance(value, bool)):
+        raise invalid_cursor
+    return value, id_
+
+
+def apply_pagination(
+        query: Select,
+        model: Any,
+        sort_key: str,
+        limit: int,
+        skip: int | None,
+        cursor: str | None,
+        descending: bool = False,
+) -> Select:
+    """
+    Order ``query`` by ``(sort_key, id)``, ascending unless ``descending``, and restrict it to one page.
+
+    When ``skip`` is given the legacy offset mode is used, otherwise the page starts right after
+    the row encoded in ``cursor``. Keyset pages fetch one extra row so that ``split_page``
+    can tell whether there is a next page.
+    """
+    id_column = model.id
+    sort_column = getattr(model, sort_key)
+    order = (id_column,) if sort_key == "id" else (sort_column, id_column)
+    query = query.order_by(*(column.desc() for column in order) if descending else order)
+
+    if skip is not None:
+        if cursor is not None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail="Use either skip or cursor, not both"
+            )
+        return query.offset(skip).limit(limit)
+
+    if cursor is not None:
+        value, last_id = decode_cursor(cursor, sort_key, sort_column.type.python_type)
+        if sort_key == "id":
+            key, last_key = id_column, last_id
+        else:
+            key, last_key = tuple_(sort_column, id_column), tuple_(value, last_id)
+        query = query.where(key < last_key if descending else key > last_key)
+    return query.limit(limit + 1)
+
+
+def split_page(items: Sequence[Any], sort_key: str, limit: int) -> tuple[Sequence[Any], dict[str, str]]:
+    """Trim the look-ahead row; return the page and the response headers pointing to the next one."""
+    if len(items) <= limit:
+        return items, {}
+    items = items[:limit]
+    last = items[-1]
+    return items, {NEXT_CURSOR_HEADER: encode_cursor(sort_key, getattr(last, sort_key), last.id)}
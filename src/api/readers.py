@@ -1,14 +1,26 @@
+# Python std lib
+from typing import Literal
+
 # Third party
-from fastapi import APIRouter, HTTPException, Depends, status
-from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 from sqlalchemy.future import select
 from sqlalchemy.exc import NoResultFound
+from sqlalchemy.orm import joinedload
 
 # Local
-from ..db import get_session
-from ..models import Reader
-from ..serializers import ReaderCreate, ReaderResponse
+from ..cache import CacheBackend, get_cache, reader_key
+from ..config import settings
+from ..db import get_read_session, get_read_session_factory, get_session
+from ..models import BorrowedBook, Reader, is_active_clause
+from ..serializers import (
+    ReaderCreate, ReaderLoanListAdapter, ReaderLoanResponse, ReaderResponse, ReaderRowListAdapter
+)
+from .conditional import dump_list, dump_rows, json_response, response_columns
+from .exports import DEFAULT_EXPORT_BATCH_SIZE, MAX_EXPORT_BATCH_SIZE, ExportFormat, export_response
 from .oauth_scheme import verify_token
+from .pagination import apply_pagination, split_page
 
 
 ####################################################################################################
@@ -35,27 +47,91 @@ async def create_reader(reader: ReaderCreate, session: AsyncSession = Depends(ge
     return new_reader
 
 
+@router.get("/export", response_class=StreamingResponse, status_code=status.HTTP_200_OK)
+async def export_readers(
+        export_format: ExportFormat = Query("ndjson", alias="format"),
+        batch_size: int = Query(DEFAULT_EXPORT_BATCH_SIZE, ge=1, le=MAX_EXPORT_BATCH_SIZE),
+        session_factory: async_sessionmaker[AsyncSession] = Depends(get_read_session_factory),
+):
+    """Stream all readers as NDJSON or CSV."""
+    query = select(Reader).order_by(Reader.id)
+    return export_response(session_factory, query, ReaderResponse, "readers", export_format, batch_size)
+
+
 @router.get("/{reader_id}", response_model=ReaderResponse, status_code=status.HTTP_200_OK)
-async def get_reader(reader_id: int, session: AsyncSession = Depends(get_session)):
+async def get_reader(
+        reader_id: int,
+        request: Request,
+        session: AsyncSession = Depends(get_session),
+        cache: CacheBackend = Depends(get_cache),
+):
     """Retrieve a reader by ID."""
-    try:
-        result = await session.execute(select(Reader).where(Reader.id == reader_id))
-        reader = result.scalar_one()
-        return reader
-    except NoResultFound:
+    content = await cache.get(reader_key(reader_id))
+    if content is None:
+        # Filled from the primary: a lagging replica would keep a stale row cached for the whole TTL.
+        try:
+            result = await session.execute(select(Reader).where(Reader.id == reader_id))
+            reader = result.scalar_one()
+        except NoResultFound:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Reader not found")
+        content = ReaderResponse.model_validate(reader).model_dump_json().encode()
+        await cache.set(reader_key(reader_id), content, settings.CACHE_TTL_SECONDS)
+    return json_response(request, content)
+
+
+@router.get("/{reader_id}/loans", response_model=list[ReaderLoanResponse], status_code=status.HTTP_200_OK)
+async def list_reader_loans(
+        reader_id: int,
+        request: Request,
+        loan_status: Literal["all", "active", "returned"] = Query("all", alias="status"),
+        cursor: str | None = None,
+        skip: int | None = Query(None, ge=0),
+        limit: int = Query(100, ge=1, le=1000),
+        session: AsyncSession = Depends(get_read_session),
+):
+    """List the loans of a reader with the title and author of each book, newest first."""
+    query = (
+        select(BorrowedBook)
+        .options(joinedload(BorrowedBook.book))
+        .where(BorrowedBook.reader_id == reader_id)
+    )
+    if loan_status == "active":
+        query = query.where(is_active_clause())
+    elif loan_status == "returned":
+        query = query.where(~is_active_clause())
+    query = apply_pagination(query, BorrowedBook, "borrowed_date", limit, skip, cursor, descending=True)
+    result = await session.execute(query)
+    loans, headers = split_page(result.scalars().all(), "borrowed_date", limit)
+    # An empty page costs one more lookup to tell an unknown reader from one without loans.
+    if not loans and await session.scalar(select(Reader.id).where(Reader.id == reader_id)) is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Reader not found")
+    return json_response(request, dump_list(ReaderLoanListAdapter, loans), headers)
 
 
 @router.get("/", response_model=list[ReaderResponse], status_code=status.HTTP_200_OK)
-async def list_readers(skip: int = 0, limit: int = 10, session: AsyncSession = Depends(get_session)):
-    """List all readers with pagination."""
-    result = await session.execute(select(Reader).offset(skip).limit(limit))
-    readers = result.scalars().all()
-    return readers
+async def list_readers(
+        request: Request,
+        cursor: str | None = None,
+        skip: int | None = Query(None, ge=0),
+        limit: int = Query(10, ge=1),
+        sort: Literal["id", "full_name", "email"] = "id",
+        session: AsyncSession = Depends(get_read_session),
+):
+    """List all readers with keyset (``cursor``) or legacy offset (``skip``) pagination."""
+    columns = response_columns(Reader, ReaderResponse)
+    query = apply_pagination(select(*columns), Reader, sort, limit, skip, cursor)
+    result = await session.execute(query)
+    rows, headers = split_page(result.all(), sort, limit)
+    return json_response(request, dump_rows(ReaderRowListAdapter, rows), headers)
 
 
 @router.put("/{reader_id}", response_model=ReaderResponse, status_code=status.HTTP_200_OK)
-async def update_reader(reader_id: int, updated_reader: ReaderCreate, session: AsyncSession = Depends(get_session)):
+async def update_reader(
+        reader_id: int,
+        updated_reader: ReaderCreate,
+        session: AsyncSession = Depends(get_session),
+        cache: CacheBackend = Depends(get_cache),
+):
     """Update an existing reader."""
     try:
         result = await session.execute(select(Reader).where(Reader.id == reader_id))
@@ -63,6 +139,7 @@ async def update_reader(reader_id: int, updated_reader: ReaderCreate, session: A
         for field, value in updated_reader.model_dump().items():
             setattr(reader, field, value)
         await session.commit()
+        await cache.delete(reader_key(reader_id))
         await session.refresh(reader)
         return reader
     except NoResultFound:
@@ -70,13 +147,16 @@ async def update_reader(reader_id: int, updated_reader: ReaderCreate, session: A
 
 
 @router.delete("/{reader_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_reader(reader_id: int, session: AsyncSession = Depends(get_session)):
+async def delete_reader(
+        reader_id: int, session: AsyncSession = Depends(get_session), cache: CacheBackend = Depends(get_cache)
+):
     """Delete a reader by ID."""
     try:
         result = await session.execute(select(Reader).where(Reader.id == reader_id))
         reader = result.scalar_one()
         await session.delete(reader)
         await session.commit()
+        await cache.delete(reader_key(reader_id))
     except NoResultFound:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Reader not found")
     return None
\ No newline at end of file
@@ -0,0 +1,181 @@
+# Python std lib
+import asyncio
+import json
+import logging
+from typing import Any, Iterable, Iterator
+
+# Third party
+from sqlalchemy import make_url
+
+# Local
+from .config import settings
+
+logger = logging.getLogger(__name__)
+# Postgres refuses NOTIFY payloads of 8000 bytes or more.
+NOTIFY_PAYLOAD_LIMIT = 7999
+
+####################################################################################################
+# CLASSES
+####################################################################################################
+
+class AvailabilityBroker:
+    """
+    In-process pub/sub of book quantity changes, fanned out to the open availability streams.
+
+    Every subscriber gets its own bounded queue. A slow client can not hold the publisher up or
+    grow memory: once its queue is full the oldest change is dropped, and since each event
+    carries the absolute quantity, the next one for the same book corrects the screen anyway.
+    """
+
+    def __init__(self, queue_size: int) -> None:
+        self.queue_size = queue_size
+        self.dropped = 0
+        self.bridge: "PostgresNotifyBridge | None" = None
+        self._subscribers: set[asyncio.Queue[tuple[int, int] | None]] = set()
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscribers)
+
+    def subscribe(self) -> asyncio.Queue[tuple[int, int] | None]:
+        queue: asyncio.Queue[tuple[int, int] | None] = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue[tuple[int, int] | None]) -> None:
+        self._subscribers.discard(queue)
+
+    def close_subscribers(self) -> None:
+        """End every open stream with ``None``; its client reconnects and starts from a fresh snapshot."""
+        for queue in self._subscribers:
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(None)
+        self._subscribers.clear()
+
+    def fan_out(self, changes: Iterable[tuple[int, int]]) -> None:
+        """Put ``(book_id, quantity)`` changes on the queue of every subscriber of this worker."""
+        changes = list(changes)
+        for queue in self._subscribers:
+            for change in changes:
+                if queue.full():
+                    queue.get_nowait()
+                    self.dropped += 1
+                queue.put_nowait(change)
+
+    async def publish(self, changes: Iterable[tuple[int, int]]) -> None:
+        """
+        Announce committed quantity changes.
+
+        With the Postgres bridge the changes go through ``NOTIFY``, and every worker, this one
+        included, fans them out when they come back on ``LISTEN``. A failing bridge must not fail
+        the request that already committed, so the changes then only reach this worker.
+        """
+        changes = [(book_id, quantity) for book_id, quantity in changes]
+        if not changes:
+            return
+        if self.bridge is None:
+            self.fan_out(changes)
+            return
+        try:
+            await self.bridge.notify(changes)
+        except Exception:
+            logger.exception("Availability NOTIFY failed, publishing to this worker only")
+            self.fan_out(changes)
+
+
+class PostgresNotifyBridge:
+    """
+    Carries availability changes between workers over Postgres ``LISTEN/NOTIFY``.
+
+    Uses one dedicated asyncpg connection per worker, outside the pool, opened on first use. An
+    asyncpg connection runs one operation at a time, so the notifications take turns on it. When
+    the connection drops, the changes sent meanwhile are lost to this worker, so its open streams
+    are closed instead of going silently stale; the next stream or notification connects again.
+    """
+
+    def __init__(self, broker: AvailabilityBroker, dsn: str, channel: str) -> None:
+        self.broker = broker
+        self.dsn = dsn
+        self.channel = channel
+        self._connection: Any = None
+        self._lock = asyncio.Lock()
+
+    async def connect(self) -> Any:
+        if self._connection is None or self._connection.is_closed():
+            # Optional dependency, only needed when streams are shared between workers.
+            import asyncpg
+
+            self._connection = await asyncpg.connect(self.dsn)
+            await self._connection.add_listener(self.channel, self.on_notify)
+            self._connection.add_termination_listener(self.on_terminate)
+        return self._connection
+
+    async def connection(self) -> Any:
+        async with self._lock:
+            return await self.connect()
+
+    async def notify(self, changes: list[tuple[int, int]]) -> None:
+        async with self._lock:
+            connection = await self.connect()
+            await connection.execute(
+                "SELECT pg_notify($1, payload) FROM unnest($2::text[]) AS payload",
+                self.channel,
+                list(notify_payloads(changes)),
+            )
+
+    def on_notify(self, connection: Any, pid: int, channel: str, payload: str) -> None:
+        self.broker.fan_out((book_id, quantity) for book_id, quantity in json.loads(payload))
+
+    def on_terminate(self, connection: Any) -> None:
+        if connection is self._connection:
+            self._connection = None
+            logger.warning("Availability LISTEN connection closed, ending the open streams")
+            self.broker.close_subscribers()
+
+    async def close(self) -> None:
+        if self._connection is not None:
+            await self._connection.close()
+            self._connection = None
+
+####################################################################################################
+# FUNCTIONS
+####################################################################################################
+
+def create_broker() -> AvailabilityBroker:
+    broker = AvailabilityBroker(queue_size=settings.AVAILABILITY_QUEUE_SIZE)
+    if settings.AVAILABILITY_NOTIFY_CHANNEL:
+        # asyncpg takes a plain postgresql:// DSN, without the SQLAlchemy driver suffix.
+        dsn = make_url(settings.get_db_url).set(drivername="postgresql").render_as_string(hide_password=False)
+        broker.bridge = PostgresNotifyBridge(broker, dsn, settings.AVAILABILITY_NOTIFY_CHANNEL)
+    return broker
+
+
+def notify_payloads(changes: list[tuple[int, int]], limit: int = NOTIFY_PAYLOAD_LIMIT) -> Iterator[str]:
+    """Split changes into JSON arrays that each fit in one ``NOTIFY`` payload."""
+    chunk: list[str] = []
+    size = 2
+    for book_id, quantity in changes:
+        item = f"[{book_id},{quantity}]"
+        if chunk and size + len(item) + 1 > limit:
+            yield f"[{','.join(chunk)}]"
+            chunk, size = [], 2
+        chunk.append(item)
+        size += len(item) + 1
+    if chunk:
+        yield f"[{','.join(chunk)}]"
+
+
+def get_availability_broker() -> AvailabilityBroker:
+    return availability_broker
+
+
+def format_event(book_id: int, quantity: int) -> str:
+    """One Server-Sent Event with the current quantity of a book."""
+    return f"event: availability\ndata: {json.dumps({'book_id': book_id, 'quantity': quantity})}\n\n"
+
+####################################################################################################
+# SETTINGS
+####################################################################################################
+
+availability_broker = create_broker()
@@ -0,0 +1,106 @@
+# Python std lib
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any
+
+# Local
+from .config import settings
+
+####################################################################################################
+# BACKENDS
+####################################################################################################
+
+class CacheBackend(ABC):
+    """Async key-value store for serialized entities. Values are opaque bytes."""
+
+    @abstractmethod
+    async def get(self, key: str) -> bytes | None:
+        ...
+
+    @abstractmethod
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        ...
+
+    @abstractmethod
+    async def delete(self, *keys: str) -> None:
+        ...
+
+
+class MemoryCache(CacheBackend):
+    """Per-process LRU with a TTL per entry."""
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[float, bytes]] = OrderedDict()
+
+    async def get(self, key: str) -> bytes | None:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        if self.maxsize <= 0:
+            return
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    async def delete(self, *keys: str) -> None:
+        for key in keys:
+            self._entries.pop(key, None)
+
+
+class RedisCache(CacheBackend):
+    """Cache shared between workers, on top of a ``redis.asyncio`` compatible client."""
+
+    def __init__(self, client: Any) -> None:
+        self.client = client
+
+    async def get(self, key: str) -> bytes | None:
+        return await self.client.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        await self.client.set(key, value, px=int(ttl * 1000))
+
+    async def delete(self, *keys: str) -> None:
+        if keys:
+            await self.client.delete(*keys)
+
+####################################################################################################
+# FUNCTIONS
+####################################################################################################
+
+def create_cache() -> CacheBackend:
+    if settings.CACHE_URL:
+        # Optional dependency, only needed when the cache is shared between workers.
+        from redis import asyncio as redis
+
+        return RedisCache(redis.from_url(settings.CACHE_URL))
+    return MemoryCache(maxsize=settings.CACHE_SIZE)
+
+
+def get_cache() -> CacheBackend:
+    return entity_cache
+
+
+def book_key(book_id: int) -> str:
+    return f"book:{book_id}"
+
+
+def reader_key(reader_id: int) -> str:
+    return f"reader:{reader_id}"
+
+####################################################################################################
+# SETTINGS
+####################################################################################################
+
+entity_cache = create_cache()
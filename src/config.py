@@ -1,14 +1,77 @@
+# Python std lib
+from typing import Literal
+
 # Third party
+from pydantic import Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
 class Settings(BaseSettings):
     SECRET_KEY: str
+    DEBUG: bool = False
     DB_LINK: str
     TEST_DB_LINK: str
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30
+    DB_POOL_RECYCLE: int = -1
+    DB_POOL_PRE_PING: bool = False
+    DB_STATEMENT_CACHE_SIZE: int = 100
+    # Pooled connections opened per engine when a worker starts, before it reports ready.
+    DB_WARMUP_CONNECTIONS: int = 5
+    # "METHOD /route/template" -> max statements per request. Over budget: a warning, or an error if strict.
+    DB_QUERY_BUDGETS: dict[str, int] = {
+        "POST /auth/token": 3,
+        "GET /books/": 1,
+        "GET /books/{book_id}": 1,
+        "GET /readers/": 1,
+        "GET /readers/{reader_id}": 1,
+        "GET /readers/{reader_id}/loans": 2,
+        "GET /borrowed_books/": 1,
+        "GET /borrowed_books/{borrowed_book_id}": 1,
+        "GET /borrowed_books/overdue": 1,
+        "POST /borrowed_books/": 3,
+        "POST /borrowed_books/checkout": 5,
+        "POST /borrowed_books/return": 4,
+        "PUT /borrowed_books/{borrowed_book_id}": 6,
+        "DELETE /borrowed_books/{borrowed_book_id}": 4,
+    }
+    DB_QUERY_BUDGET_STRICT: bool = False
+    DB_REPEATED_QUERY_THRESHOLD: int = 5
+    DB_REPLICA_LINKS: list[str] = []
+    DB_REPLICA_STRATEGY: Literal["round_robin", "least_busy"] = "round_robin"
+    DB_REPLICA_STICKY_SECONDS: float = 5
+    LOAN_PERIOD_DAYS: int = 14
     JWT_ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
     REFRESH_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 3
+    TOKEN_CACHE_SIZE: int = 10_000
+    REVOCATION_BLOOM_CAPACITY: int = 1_000_000
+    REVOCATION_BLOOM_ERROR_RATE: float = 0.001
+    REVOCATION_CACHE_SIZE: int = 10_000
+    REVOCATION_SYNC_SECONDS: float = 5
+    # Ids are handed out before commit, so a revocation can become visible below ids already synced.
+    REVOCATION_SYNC_OVERLAP: int = 1000
+    # The Bloom filter can not forget, so it is rebuilt from the table to drop pruned revocations.
+    REVOCATION_REBUILD_SECONDS: float = 3600
+    CACHE_URL: str | None = None
+    CACHE_SIZE: int = 10_000
+    CACHE_TTL_SECONDS: float = 300
+    AVAILABILITY_QUEUE_SIZE: int = 100
+    AVAILABILITY_KEEPALIVE_SECONDS: float = 15
+    # Set to fan availability events out to every worker through Postgres LISTEN/NOTIFY on this channel.
+    AVAILABILITY_NOTIFY_CHANNEL: str | None = None
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_URL: str | None = None
+    RATE_LIMIT_SHARDS: int = Field(16, gt=0)
+    RATE_LIMIT_MAX_KEYS: int = 100_000
+    # Limits are divided by, turn RATE_LIMIT_ENABLED off instead of setting them to 0.
+    LOGIN_RATE_LIMIT_IP_PER_MINUTE: float = Field(30, gt=0)
+    LOGIN_RATE_LIMIT_IP_BURST: int = Field(20, gt=0)
+    LOGIN_RATE_LIMIT_EMAIL_PER_MINUTE: float = Field(5, gt=0)
+    LOGIN_RATE_LIMIT_EMAIL_BURST: int = Field(5, gt=0)
+    BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASHER_WORKERS: int = 4
 
     @property
     def get_secret_key(self):
@@ -1,25 +1,249 @@
 # Python std lib
-from typing import Any, AsyncGenerator
+import asyncio
+import itertools
+import time
+from collections import OrderedDict
+from typing import Any, AsyncGenerator, Sequence
 
 # Third party
-from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from fastapi import Request
+from sqlalchemy import Executable, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool, Pool, PoolProxiedConnection
 
 # Local
 from .config import settings
+from .metrics import instrument_engine
+
+####################################################################################################
+# CLASSES
+####################################################################################################
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool that also tracks the callers waiting for a connection and how long they waited."""
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.waiters = 0
+        self.acquire_count = 0
+        self.acquire_seconds_total = 0.0
+
+    def connect(self) -> PoolProxiedConnection:
+        self.waiters += 1
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            self.waiters -= 1
+            self.acquire_count += 1
+            self.acquire_seconds_total += time.perf_counter() - started
+
+
+class ReplicaRouter:
+    """
+    Chooses the session factory for read-only requests.
+
+    Reads go to the replicas, round-robin or to the one with the fewest checked out connections.
+    A client that has just written is kept on the primary for ``sticky_seconds``, so it reads its
+    own writes even while the replicas lag behind. Without replicas everything uses the primary.
+    """
+
+    def __init__(
+            self,
+            primary: async_sessionmaker[AsyncSession],
+            replicas: list[async_sessionmaker[AsyncSession]],
+            strategy: str,
+            sticky_seconds: float,
+    ) -> None:
+        self.primary = primary
+        self.replicas = replicas
+        self.strategy = strategy
+        self.sticky_seconds = sticky_seconds
+        self._round_robin = itertools.cycle(replicas)
+        self._recent_writers: OrderedDict[str, float] = OrderedDict()
+
+    def mark_write(self, client_key: str) -> None:
+        if self.sticky_seconds <= 0:
+            return
+        now = time.monotonic()
+        self._recent_writers[client_key] = now
+        self._recent_writers.move_to_end(client_key)
+        while next(iter(self._recent_writers.values())) <= now - self.sticky_seconds:
+            self._recent_writers.popitem(last=False)
+
+    def choose(self, client_key: str) -> async_sessionmaker[AsyncSession]:
+        if not self.replicas:
+            return self.primary
+        last_write = self._recent_writers.get(client_key)
+        if last_write is not None and last_write > time.monotonic() - self.sticky_seconds:
+            return self.primary
+        if self.strategy == "least_busy":
+            return min(self.replicas, key=lambda factory: factory.kw["bind"].pool.checkedout())
+        return next(self._round_robin)
+
+
+class Database:
+    """
+    The engines and session factories of one worker.
+
+    Nothing is created on import: a server that forks its workers after importing the app would
+    otherwise share engines between processes. The lifespan of the app calls ``start`` in each
+    worker; scripts and tests that skip it get the engines created on first use.
+    """
+
+    def __init__(self, url: str, replica_urls: list[str]) -> None:
+        self.url = url
+        self.replica_urls = replica_urls
+        self.ready = False
+        self._engine: AsyncEngine | None = None
+        self._replica_engines: list[AsyncEngine] = []
+        self._session_factory: async_sessionmaker[AsyncSession] | None = None
+        self._replica_router: ReplicaRouter | None = None
+
+    @property
+    def started(self) -> bool:
+        return self._engine is not None
+
+    def start(self) -> None:
+        if self.started:
+            return
+        self._engine = create_engine(self.url)
+        self._session_factory = async_sessionmaker(self._engine, expire_on_commit=False)
+        self._replica_engines = [create_engine(url) for url in self.replica_urls]
+        self._replica_router = ReplicaRouter(
+            primary=self._session_factory,
+            replicas=[async_sessionmaker(replica, expire_on_commit=False) for replica in self._replica_engines],
+            strategy=settings.DB_REPLICA_STRATEGY,
+            sticky_seconds=settings.DB_REPLICA_STICKY_SECONDS,
+        )
+
+    @property
+    def engine(self) -> AsyncEngine:
+        self.start()
+        return self._engine
+
+    @property
+    def replica_engines(self) -> list[AsyncEngine]:
+        self.start()
+        return self._replica_engines
+
+    @property
+    def session_factory(self) -> async_sessionmaker[AsyncSession]:
+        self.start()
+        return self._session_factory
+
+    @property
+    def replica_router(self) -> ReplicaRouter:
+        self.start()
+        return self._replica_router
+
+    async def warm_up(self, connections: int, statements: Sequence[Executable] = ()) -> None:
+        """
+        Open ``connections`` connections per engine and run ``statements`` on each.
+
+        The connections go back to the pool warm, so the first requests skip the connection setup,
+        and asyncpg keeps the statements prepared on every one of them.
+        """
+        for engine in (self.engine, *self.replica_engines):
+            # Past the pool size the connections would be overflow ones, closed as soon as released.
+            count = min(connections, engine.pool.size()) if hasattr(engine.pool, "size") else connections
+            results = await asyncio.gather(*(engine.connect().start() for _ in range(count)), return_exceptions=True)
+            # Every connection that did open goes back to the pool, even when some of the others failed.
+            opened = [result for result in results if not isinstance(result, BaseException)]
+            try:
+                for result in results:
+                    if isinstance(result, BaseException):
+                        raise result
+                for connection in opened:
+                    for statement in statements:
+                        await connection.execute(statement)
+                    await connection.rollback()
+            finally:
+                for connection in opened:
+                    await connection.close()
+        self.ready = True
+
+    async def dispose(self) -> None:
+        self.ready = False
+        for engine in (self._engine, *self._replica_engines):
+            if engine is not None:
+                await engine.dispose()
+        self._engine = None
+        self._replica_engines = []
+        self._session_factory = None
+        self._replica_router = None
+
+####################################################################################################
+# FUNCTIONS
+####################################################################################################
+
+def client_key(request: Request) -> str:
+    """Identify the client for read-your-writes: by its token, or by its address before sign-in."""
+    return request.headers.get("authorization") or (request.client.host if request.client else "")
+
+
+def create_engine(url: str) -> AsyncEngine:
+    engine = create_async_engine(url, echo=False, **engine_options(url))
+    instrument_engine(engine)
+    return engine
+
+
+def engine_options(url: str) -> dict[str, Any]:
+    """Pool and driver options from ``Settings``; SQLite keeps the pool SQLAlchemy picks for it."""
+    url = make_url(url)
+    if url.get_backend_name() == "sqlite":
+        return {}
+
+    options: dict[str, Any] = {
+        "poolclass": InstrumentedQueuePool,
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+    }
+    if url.get_driver_name() == "asyncpg":
+        options["connect_args"] = {"prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE}
+    return options
+
+
+def pool_stats(pool: Pool) -> dict[str, int | float]:
+    """Snapshot of a pool; counters a pool class does not have are reported as zero."""
+    return {
+        "size": pool.size() if hasattr(pool, "size") else 0,
+        "checked_in": pool.checkedin() if hasattr(pool, "checkedin") else 0,
+        "checked_out": pool.checkedout() if hasattr(pool, "checkedout") else 0,
+        "overflow": max(pool.overflow(), 0) if hasattr(pool, "overflow") else 0,
+        "waiters": getattr(pool, "waiters", 0),
+        "acquire_count": getattr(pool, "acquire_count", 0),
+        "acquire_seconds_total": getattr(pool, "acquire_seconds_total", 0.0),
+    }
 
 ####################################################################################################
 # SETTINGS
 ####################################################################################################
 
-engine = create_async_engine(settings.get_db_url, echo=False)
-SessionFactory = async_sessionmaker(engine, expire_on_commit=False)
+database = Database(settings.get_db_url, settings.DB_REPLICA_LINKS)
 Base = declarative_base()
 
 ####################################################################################################
-# FUNCTIONS
+# DEPENDENCIES
 ####################################################################################################
 
-async def get_session() -> AsyncGenerator[AsyncSession, Any]:
-    async with SessionFactory() as session:
+async def get_session(request: Request) -> AsyncGenerator[AsyncSession, Any]:
+    async with database.session_factory() as session:
         yield session
+    if request.method not in ("GET", "HEAD", "OPTIONS"):
+        database.replica_router.mark_write(client_key(request))
+
+
+async def get_read_session(request: Request) -> AsyncGenerator[AsyncSession, Any]:
+    """Session for read-only endpoints, on a replica unless the client has just written."""
+    async with database.replica_router.choose(client_key(request))() as session:
+        yield session
+
+
+def get_read_session_factory(request: Request) -> async_sessionmaker[AsyncSession]:
+    """For read-only endpoints that open sessions themselves, e.g. streaming responses."""
+    return database.replica_router.choose(client_key(request))
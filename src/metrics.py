@@ -0,0 +1,166 @@
+# Python std lib
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Any, Iterable, Iterator
+
+# Third party
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+####################################################################################################
+# SETTINGS
+####################################################################################################
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+####################################################################################################
+# CLASSES
+####################################################################################################
+
+# Every metric is recorded from the event loop thread of its worker (SQLAlchemy's async engine
+# runs the cursor events there too), so plain dict updates are enough and nothing takes a lock.
+# Each worker exposes its own values; Prometheus sums them over the scraped instances.
+
+class Counter:
+    def __init__(self, name: str, documentation: str, label_names: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, labels: tuple[str, ...] = (), amount: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in self.values.items():
+            yield f"{self.name}{format_labels(self.label_names, labels)} {value}"
+
+
+class Histogram:
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            label_names: tuple[str, ...] = (),
+            buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = buckets
+        # Per label set: one count per bucket plus +Inf, then the sum of observed values.
+        self.series: dict[tuple[str, ...], list[float]] = {}
+
+    def observe(self, value: float, labels: tuple[str, ...] = ()) -> None:
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 2)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), series):
+                cumulative += count
+                bucket_labels = format_labels((*self.label_names, "le"), (*labels, str(bound)))
+                yield f"{self.name}_bucket{bucket_labels} {cumulative}"
+            yield f"{self.name}_sum{format_labels(self.label_names, labels)} {series[-1]}"
+            yield f"{self.name}_count{format_labels(self.label_names, labels)} {cumulative}"
+
+
+class QueryStats:
+    """Statements run while serving one request, with their total time and how often each repeated."""
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.seconds = 0.0
+        self.statements: dict[str, int] = {}
+
+    def record(self, statement: str, elapsed: float) -> None:
+        self.count += 1
+        self.seconds += elapsed
+        self.statements[statement] = self.statements.get(statement, 0) + 1
+
+    def repeated(self, threshold: int) -> dict[str, int]:
+        return {statement: count for statement, count in self.statements.items() if count >= threshold}
+
+
+class QueryBudgetExceeded(RuntimeError):
+    pass
+
+####################################################################################################
+# METRICS
+####################################################################################################
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "HTTP requests by route and status code.", ("method", "route", "status")
+)
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route.", ("method", "route")
+)
+SQL_DURATION = Histogram(
+    "db_statement_duration_seconds", "SQL statement execution time by statement type.", ("statement",), SQL_BUCKETS
+)
+REGISTRY: list[Counter | Histogram] = [HTTP_REQUESTS, HTTP_LATENCY, SQL_DURATION]
+
+# Set for the duration of a request; SQLAlchemy runs the cursor events in the request's context.
+query_stats: ContextVar[QueryStats | None] = ContextVar("query_stats", default=None)
+
+####################################################################################################
+# FUNCTIONS
+####################################################################################################
+
+def escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    pairs = [f'{name}="{escape_label_value(value)}"' for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def before_cursor_execute(conn: Any, cursor: Any, statement: str, parameters: Any, context: Any, executemany: bool):
+    context.metrics_started_at = time.perf_counter()
+
+
+def after_cursor_execute(conn: Any, cursor: Any, statement: str, parameters: Any, context: Any, executemany: bool):
+    elapsed = time.perf_counter() - context.metrics_started_at
+    # Only the leading keyword is used as a label, so the number of series stays small.
+    keyword = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "EMPTY"
+    SQL_DURATION.observe(elapsed, (keyword,))
+    stats = query_stats.get()
+    if stats is not None:
+        stats.record(statement, elapsed)
+
+
+def instrument_engine(engine: AsyncEngine) -> None:
+    event.listen(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine.sync_engine, "after_cursor_execute", after_cursor_execute)
+
+
+def render_samples(
+        name: str,
+        kind: str,
+        documentation: str,
+        label_names: tuple[str, ...],
+        samples: dict[tuple[str, ...], float],
+) -> Iterator[str]:
+    """Values read at scrape time from state kept elsewhere, e.g. pool or cache counters."""
+    yield f"# HELP {name} {documentation}"
+    yield f"# TYPE {name} {kind}"
+    for labels, value in samples.items():
+        yield f"{name}{format_labels(label_names, labels)} {value}"
+
+
+def render_metrics(extra: Iterable[str] = ()) -> str:
+    """Prometheus text exposition of every registered metric, followed by ``extra`` lines."""
+    lines = [line for metric in REGISTRY for line in metric.render()]
+    lines.extend(extra)
+    return "\n".join(lines) + "\n"
@@ -22,6 +22,23 @@ config.set_main_option('sqlalchemy.url', settings.get_db_url + "?async_fallback=
 # Мета-данные для моделей, необходимые для автоматических миграций
 target_metadata = Base.metadata  # Убедись, что Base — это правильный объект для твоих моделей
 
+# Объекты полнотекстового поиска создаются миграцией вручную (см. src/search.py),
+# в моделях их нет, поэтому autogenerate не должен предлагать их удалить.
+SEARCH_OBJECTS = {
+    "search_vector",
+    "ix_books_search_vector",
+    "ix_books_title_trgm",
+    "ix_books_author_trgm",
+}
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    """Исключает из autogenerate объекты, которых нет в моделях."""
+    if name in SEARCH_OBJECTS or (type_ == "table" and name.startswith("books_fts")):
+        return False
+    return True
+
+
 def run_migrations_offline() -> None:
     """Запуск миграций в 'офлайн' режиме.
 
@@ -35,6 +52,7 @@ def run_migrations_offline() -> None:
         target_metadata=target_metadata,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
+        include_object=include_object,
     )
 
     with context.begin_transaction():
@@ -51,7 +69,9 @@ async def run_migrations_online():
         poolclass=pool.NullPool,
     )
 
-    async with connectable.begin() as connection:
+    # Транзакцией управляет Alembic, чтобы миграции могли выйти из неё (autocommit_block),
+    # например для CREATE INDEX CONCURRENTLY.
+    async with connectable.connect() as connection:
         await connection.run_sync(do_run_migrations)
 
     await connectable.dispose()
@@ -62,8 +82,10 @@ def do_run_migrations(connection):
         connection=connection,
         target_metadata=target_metadata,
         compare_server_default=True,
+        include_object=include_object,
     )
-    context.run_migrations()
+    with context.begin_transaction():
+        context.run_migrations()
 
 # Запуск в зависимости от того, в каком режиме работаем (онлайн или офлайн)
 if context.is_offline_mode():
@@ -0,0 +1,51 @@
+"""Add full-text search to books
+
+Revision ID: 392eca214e3d
+Revises: 7eeb3318566d
+Create Date: 2026-10-18 10:12:41.503127
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+from src.search import POSTGRES_SEARCH_DDL, SQLITE_SEARCH_DDL
+
+
+# revision identifiers, used by Alembic.
+revision: str = "392eca214e3d"
+down_revision: Union[str, None] = "7eeb3318566d"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if op.get_bind().dialect.name == "sqlite":
+        for statement in SQLITE_SEARCH_DDL:
+            op.execute(statement)
+        op.execute("INSERT INTO books_fts (books_fts) VALUES ('rebuild')")
+        return
+
+    for statement in POSTGRES_SEARCH_DDL:
+        op.execute(statement)
+    # Fire the trigger once per existing row to fill search_vector.
+    op.execute("UPDATE books SET title = title")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name == "sqlite":
+        op.execute("DROP TRIGGER IF EXISTS books_fts_update")
+        op.execute("DROP TRIGGER IF EXISTS books_fts_delete")
+        op.execute("DROP TRIGGER IF EXISTS books_fts_insert")
+        op.execute("DROP TABLE IF EXISTS books_fts")
+        return
+
+    op.drop_index("ix_books_author_trgm", table_name="books")
+    op.drop_index("ix_books_title_trgm", table_name="books")
+    op.drop_index("ix_books_search_vector", table_name="books")
+    op.execute("DROP TRIGGER IF EXISTS books_search_vector_update ON books")
+    op.execute("DROP FUNCTION IF EXISTS books_search_vector_update()")
+    op.drop_column("books", "search_vector")
@@ -0,0 +1,45 @@
+"""Add partial index on open loans
+
+Revision ID: 5e8a0c3d7f21
+Revises: c4d1f7a2b9e0
+Create Date: 2026-10-18 14:05:32.610274
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "5e8a0c3d7f21"
+down_revision: Union[str, None] = "c4d1f7a2b9e0"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CONCURRENTLY keeps borrowed_books writable while a big table is
+    # indexed; it can not run inside the migration transaction.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_borrowed_books_open_borrowed_date",
+            "borrowed_books",
+            ["borrowed_date", "id"],
+            unique=False,
+            postgresql_where=sa.text("return_date IS NULL"),
+            postgresql_concurrently=True,
+            sqlite_where=sa.text("return_date IS NULL"),
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(
+        "ix_borrowed_books_open_borrowed_date",
+        table_name="borrowed_books",
+        postgresql_where=sa.text("return_date IS NULL"),
+        sqlite_where=sa.text("return_date IS NULL"),
+    )
@@ -0,0 +1,50 @@
+"""Replace reader_id index with reader loan history index
+
+Revision ID: a81f4c6e2d95
+Revises: 5e8a0c3d7f21
+Create Date: 2026-10-18 15:22:48.903117
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "a81f4c6e2d95"
+down_revision: Union[str, None] = "5e8a0c3d7f21"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # reader_id leads the new index, so the single-column one is redundant
+    # and is dropped only once its replacement exists.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_borrowed_books_reader_history",
+            "borrowed_books",
+            ["reader_id", "borrowed_date", "id"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            "ix_borrowed_books_reader_id",
+            table_name="borrowed_books",
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.create_index(
+        "ix_borrowed_books_reader_id",
+        "borrowed_books",
+        ["reader_id"],
+        unique=False,
+    )
+    op.drop_index(
+        "ix_borrowed_books_reader_history", table_name="borrowed_books"
+    )
@@ -0,0 +1,52 @@
+"""Add active_loans counter to readers
+
+Revision ID: c4d1f7a2b9e0
+Revises: 392eca214e3d
+Create Date: 2026-10-18 12:40:07.218455
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "c4d1f7a2b9e0"
+down_revision: Union[str, None] = "392eca214e3d"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table("readers") as batch_op:
+        batch_op.add_column(
+            sa.Column(
+                "active_loans",
+                sa.Integer(),
+                server_default="0",
+                nullable=False,
+            )
+        )
+    op.execute(
+        """
+        UPDATE readers SET active_loans = (
+            SELECT count(*) FROM borrowed_books
+            WHERE borrowed_books.reader_id = readers.id
+              AND borrowed_books.return_date IS NULL
+        )
+        """
+    )
+    with op.batch_alter_table("readers") as batch_op:
+        batch_op.create_check_constraint(
+            "ck_readers_active_loans", "active_loans >= 0"
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table("readers") as batch_op:
+        batch_op.drop_constraint("ck_readers_active_loans", type_="check")
+        batch_op.drop_column("active_loans")
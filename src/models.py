@@ -3,7 +3,7 @@ import datetime
 from typing import Annotated
 
 # Third party
-from sqlalchemy import String, CheckConstraint, Date, ForeignKey, func
+from sqlalchemy import String, CheckConstraint, ColumnElement, Date, DateTime, ForeignKey, Index, func, text
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 # Local
@@ -27,12 +27,28 @@ class Librarian(Base):
     password: Mapped[str] = mapped_column(String(255), nullable=False)
 
 
+class RevokedToken(Base):
+    __tablename__ = "revoked_tokens"
+
+    # Ever increasing, so workers fetch only the revocations added since their last sync.
+    id: Mapped[intpk]
+    jti: Mapped[str] = mapped_column(String(64), unique=True, nullable=False)
+    expires_at: Mapped[datetime.datetime] = mapped_column(DateTime(timezone=True), nullable=False, index=True)
+
+
 class Reader(Base):
     __tablename__ = "readers"
 
     id: Mapped[intpk]
     full_name: Mapped[str] = mapped_column(String(255), nullable=False, index=True)
     email: Mapped[str] = mapped_column(String(255), unique=True, nullable=False, index=True)
+    # Loans without a return date; kept in step with borrowed_books by the checkout, return and delete endpoints.
+    active_loans: Mapped[int] = mapped_column(
+        CheckConstraint("active_loans >= 0", name="ck_readers_active_loans"),
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
 
     borrowed_books: Mapped[list["BorrowedBook"]] = relationship(back_populates="reader")
 
@@ -53,12 +69,37 @@ class Book(Base):
 
 class BorrowedBook(Base):
     __tablename__ = "borrowed_books"
+    __table_args__ = (
+        # Open loans only: the overdue report stays small however long the returned history gets.
+        Index(
+            "ix_borrowed_books_open_borrowed_date",
+            "borrowed_date",
+            "id",
+            postgresql_where=text("return_date IS NULL"),
+            sqlite_where=text("return_date IS NULL"),
+        ),
+        # A reader's loan history, newest first and page by page; also serves plain reader_id lookups.
+        Index("ix_borrowed_books_reader_history", "reader_id", "borrowed_date", "id"),
+    )
 
     id: Mapped[intpk]
-    reader_id: Mapped[int] = mapped_column(ForeignKey("readers.id"), nullable=False, index=True)
+    reader_id: Mapped[int] = mapped_column(ForeignKey("readers.id"), nullable=False)
     book_id: Mapped[int] = mapped_column(ForeignKey("books.id"), nullable=False, index=True)
     borrowed_date: Mapped[datetime.date] = mapped_column(Date, nullable=False, server_default=func.current_date())
     return_date: Mapped[datetime.date] = mapped_column(Date, nullable=True, server_default=None)
 
     reader: Mapped["Reader"] = relationship("Reader", back_populates="borrowed_books")
     book: Mapped["Book"] = relationship("Book", back_populates="borrowed_books")
+
+####################################################################################################
+# FUNCTIONS
+####################################################################################################
+
+def is_active(return_date: datetime.date | None) -> bool:
+    """A loan holds its copy and the reader's slot until a return date is recorded."""
+    return return_date is None
+
+
+def is_active_clause() -> ColumnElement[bool]:
+    """``is_active`` as a filter on borrowed_books."""
+    return BorrowedBook.return_date.is_(None)
@@ -0,0 +1,153 @@
+# Python std lib
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Callable
+
+# Local
+from .config import settings
+
+####################################################################################################
+# STORES
+####################################################################################################
+
+class RateLimitStore(ABC):
+    """Token buckets by key. ``take`` spends one token and returns how long to wait for it, 0 if allowed."""
+
+    @abstractmethod
+    async def take(self, key: str, rate: float, burst: int) -> float:
+        ...
+
+
+class MemoryRateLimitStore(RateLimitStore):
+    """
+    Per-process buckets, split over shards by key hash.
+
+    A bucket that has refilled is the same as no bucket, so it can be forgotten without changing
+    any decision. Each ``take`` sweeps such buckets off the least recently used end of its own
+    shard, which keeps the cost of expiry small and bounded; a shard that is still over its share
+    of ``max_keys`` drops its least recently used buckets, letting those clients start over.
+    """
+
+    def __init__(self, shards: int, max_keys: int, clock: Callable[[], float] = time.monotonic) -> None:
+        self.max_keys_per_shard = max(max_keys // shards, 1)
+        self.clock = clock
+        # key -> (tokens, updated at, full again at), least recently used first.
+        self._shards: list[OrderedDict[str, tuple[float, float, float]]] = [OrderedDict() for _ in range(shards)]
+
+    async def take(self, key: str, rate: float, burst: int) -> float:
+        shard = self._shards[hash(key) % len(self._shards)]
+        now = self.clock()
+        tokens, updated, _ = shard.pop(key, (burst, now, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / rate
+        shard[key] = (tokens, now, now + (burst - tokens) / rate)
+
+        while len(shard) > 1:
+            _, _, full_at = next(iter(shard.values()))
+            if full_at > now and len(shard) <= self.max_keys_per_shard:
+                break
+            shard.popitem(last=False)
+        return wait
+
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in self._shards)
+
+
+class RedisRateLimitStore(RateLimitStore):
+    """Buckets shared between workers, on top of a ``redis.asyncio`` compatible client."""
+
+    # Refill, take and expire in one round trip, atomically, on the Redis clock.
+    TAKE_SCRIPT = """
+        local rate, burst = tonumber(ARGV[1]), tonumber(ARGV[2])
+        local time = redis.call('TIME')
+        local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+        local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+        local tokens = tonumber(bucket[1]) or burst
+        local updated = tonumber(bucket[2]) or now
+        tokens = math.min(burst, tokens + (now - updated) * rate)
+        local wait = 0
+        if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / rate end
+        redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+        redis.call('PEXPIRE', KEYS[1], math.ceil((burst - tokens) / rate * 1000))
+        return tostring(wait)
+    """
+
+    def __init__(self, client: Any) -> None:
+        self.client = client
+        self.script = client.register_script(self.TAKE_SCRIPT)
+
+    async def take(self, key: str, rate: float, burst: int) -> float:
+        return float(await self.script(keys=[key], args=[rate, burst]))
+
+####################################################################################################
+# CLASSES
+####################################################################################################
+
+class LoginRateLimiter:
+    """
+    Sheds sign-in and sign-up attempts per client IP and per email before they reach bcrypt.
+
+    The IP bucket is checked first: an address that is already over its limit does not spend the
+    tokens of the emails it tries, so a credential-stuffing source can not lock their owners out.
+    """
+
+    def __init__(
+            self,
+            store: RateLimitStore,
+            ip_per_minute: float,
+            ip_burst: int,
+            email_per_minute: float,
+            email_burst: int,
+            enabled: bool = True,
+    ) -> None:
+        self.store = store
+        self.ip_rate, self.ip_burst = ip_per_minute / 60, ip_burst
+        self.email_rate, self.email_burst = email_per_minute / 60, email_burst
+        self.enabled = enabled
+
+    async def check(self, ip: str, email: str) -> float:
+        """Seconds to wait before the next attempt is allowed, 0 if this one is."""
+        if not self.enabled:
+            return 0.0
+        wait = await self.store.take(f"login:ip:{ip}", self.ip_rate, self.ip_burst)
+        if wait:
+            return wait
+        return await self.store.take(f"login:email:{email.lower()}", self.email_rate, self.email_burst)
+
+####################################################################################################
+# FUNCTIONS
+####################################################################################################
+
+def create_rate_limit_store() -> RateLimitStore:
+    if settings.RATE_LIMIT_URL:
+        # Optional dependency, only needed when the limits are shared between workers.
+        from redis import asyncio as redis
+
+        return RedisRateLimitStore(redis.from_url(settings.RATE_LIMIT_URL))
+    return MemoryRateLimitStore(shards=settings.RATE_LIMIT_SHARDS, max_keys=settings.RATE_LIMIT_MAX_KEYS)
+
+
+def create_login_limiter(store: RateLimitStore) -> LoginRateLimiter:
+    return LoginRateLimiter(
+        store,
+        ip_per_minute=settings.LOGIN_RATE_LIMIT_IP_PER_MINUTE,
+        ip_burst=settings.LOGIN_RATE_LIMIT_IP_BURST,
+        email_per_minute=settings.LOGIN_RATE_LIMIT_EMAIL_PER_MINUTE,
+        email_burst=settings.LOGIN_RATE_LIMIT_EMAIL_BURST,
+        enabled=settings.RATE_LIMIT_ENABLED,
+    )
+
+
+def get_login_limiter() -> LoginRateLimiter:
+    return login_limiter
+
+####################################################################################################
+# SETTINGS
+####################################################################################################
+
+login_limiter = create_login_limiter(create_rate_limit_store())
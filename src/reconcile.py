@@ -0,0 +1,67 @@
+"""
+Repair drift of the denormalized ``Reader.active_loans`` counter.
+
+    python -m src.reconcile            # fix every reader whose counter is off
+    python -m src.reconcile --dry-run  # only report them
+"""
+
+# Python std lib
+import argparse
+import asyncio
+from typing import Any, Sequence
+
+# Third party
+from sqlalchemy import ScalarSelect, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# Local
+from .db import database
+from .models import BorrowedBook, Reader, is_active_clause
+
+####################################################################################################
+# FUNCTIONS
+####################################################################################################
+
+def active_loans_count(reader_id: Any) -> ScalarSelect[int]:
+    """Count the loans of a reader that have no return date yet."""
+    return (
+        select(func.count())
+        .select_from(BorrowedBook)
+        .where(
+            BorrowedBook.reader_id == reader_id,
+            is_active_clause(),
+        )
+        .scalar_subquery()
+    )
+
+
+async def reconcile_active_loans(session: AsyncSession, dry_run: bool = False) -> Sequence[Any]:
+    """Recount the active loans of every reader; return ``(reader_id, stored, actual)`` of the drifted ones."""
+    actual = active_loans_count(Reader.id)
+    result = await session.execute(
+        select(Reader.id, Reader.active_loans, actual).where(Reader.active_loans != actual).with_for_update()
+    )
+    drifted = result.all()
+    if drifted and not dry_run:
+        await session.execute(
+            update(Reader)
+            .where(Reader.id.in_([reader_id for reader_id, _, _ in drifted]))
+            .values(active_loans=active_loans_count(Reader.id))
+        )
+        await session.commit()
+    return drifted
+
+
+async def main(dry_run: bool) -> None:
+    async with database.session_factory() as session:
+        drifted = await reconcile_active_loans(session, dry_run=dry_run)
+    await database.dispose()
+    for reader_id, stored, actual in drifted:
+        print(f"reader {reader_id}: active_loans {stored} -> {actual}")
+    print(f"{len(drifted)} reader(s) {'to fix' if dry_run else 'fixed'}.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recount Reader.active_loans from borrowed_books.")
+    parser.add_argument("--dry-run", action="store_true", help="Only report the drifted readers.")
+    asyncio.run(main(parser.parse_args().dry_run))
@@ -0,0 +1,189 @@
+"""
+Revoked refresh tokens: the ``revoked_tokens`` table and the per-worker filter in front of it.
+
+    python -m src.revocation  # delete revocations of tokens that have expired anyway
+"""
+
+# Python std lib
+import asyncio
+import datetime
+import hashlib
+import math
+import time
+from collections import OrderedDict
+
+# Third party
+from sqlalchemy import delete, exists, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# Local
+from .config import settings
+from .db import database
+from .models import RevokedToken
+
+####################################################################################################
+# CLASSES
+####################################################################################################
+
+class BloomFilter:
+    """Set of strings with no false negatives and about ``error_rate`` false positives at ``capacity``."""
+
+    def __init__(self, capacity: int, error_rate: float) -> None:
+        self.size = max(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(round(self.size / capacity * math.log(2)), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def positions(self, key: str) -> list[int]:
+        # Double hashing: two halves of one digest make all ``hashes`` positions.
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, key: str) -> None:
+        for position in self.positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(key))
+
+
+class RevocationList:
+    """
+    Answers "is this refresh token revoked?" mostly without a query.
+
+    The Bloom filter holds every revocation this worker has seen, so a token it does not contain
+    is certainly not revoked. Positives, true or false, are settled by the table once and then
+    remembered in a bounded LRU. Revocations made by other workers are pulled every
+    ``sync_seconds`` by id. The ids come from a sequence before the transactions commit, so a
+    revocation can show up after a higher id was already loaded; every pull therefore starts
+    ``sync_overlap`` ids below the highest one seen and re-reads that window.
+
+    Bits can not be taken out of a Bloom filter, so revocations deleted by ``prune_revoked_tokens``
+    would keep raising its false positive rate. Every ``rebuild_seconds`` a sync therefore loads
+    the whole table into a fresh filter and swaps it in once it is complete; a revocation this
+    worker records during that load is picked up again by the overlap of the next sync.
+    """
+
+    def __init__(
+            self,
+            capacity: int,
+            error_rate: float,
+            cache_size: int,
+            sync_seconds: float,
+            sync_overlap: int,
+            rebuild_seconds: float,
+    ) -> None:
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bloom = BloomFilter(capacity, error_rate)
+        self.cache_size = cache_size
+        self.sync_seconds = sync_seconds
+        self.sync_overlap = sync_overlap
+        self.rebuild_seconds = rebuild_seconds
+        self.watermark = 0
+        self.synced_at = -math.inf
+        self.rebuilt_at = time.monotonic()
+        self.lookups = 0
+        self._answers: OrderedDict[str, bool] = OrderedDict()
+
+    def remember(self, jti: str, revoked: bool) -> None:
+        if self.cache_size <= 0:
+            return
+        self._answers[jti] = revoked
+        self._answers.move_to_end(jti)
+        if len(self._answers) > self.cache_size:
+            self._answers.popitem(last=False)
+
+    def add(self, jti: str) -> None:
+        self.bloom.add(jti)
+        self.remember(jti, True)
+
+    async def sync(self, session: AsyncSession) -> None:
+        now = time.monotonic()
+        if now - self.synced_at < self.sync_seconds:
+            return
+        self.synced_at = now
+        rebuild = now - self.rebuilt_at >= self.rebuild_seconds
+        since = 0 if rebuild else self.watermark - self.sync_overlap
+        result = await session.execute(
+            select(RevokedToken.id, RevokedToken.jti).where(RevokedToken.id > since).order_by(RevokedToken.id)
+        )
+        if rebuild:
+            # Swapped in only once filled; the old filter answered while the table was being read.
+            bloom = BloomFilter(self.capacity, self.error_rate)
+            self.watermark = 0
+        else:
+            bloom = self.bloom
+        for token_id, jti in result.all():
+            bloom.add(jti)
+            self.remember(jti, True)
+            self.watermark = max(self.watermark, token_id)
+        if rebuild:
+            self.bloom = bloom
+            self.rebuilt_at = now
+
+    async def is_revoked(self, session: AsyncSession, jti: str) -> bool:
+        await self.sync(session)
+        if jti not in self.bloom:
+            return False
+        revoked = self._answers.get(jti)
+        if revoked is None:
+            self.lookups += 1
+            revoked = bool(await session.scalar(select(exists().where(RevokedToken.jti == jti))))
+            self.remember(jti, revoked)
+        else:
+            self._answers.move_to_end(jti)
+        return revoked
+
+####################################################################################################
+# FUNCTIONS
+####################################################################################################
+
+async def revoke(session: AsyncSession, jti: str, expires_at: datetime.datetime) -> bool:
+    """Record a revocation; ``False`` if the token was revoked already, e.g. by a concurrent refresh."""
+    connection = await session.connection()
+    dialect_insert = postgresql.insert if connection.dialect.name == "postgresql" else sqlite.insert
+    result = await session.execute(
+        dialect_insert(RevokedToken)
+        .values(jti=jti, expires_at=expires_at)
+        .on_conflict_do_nothing(index_elements=[RevokedToken.jti])
+        .returning(RevokedToken.id)
+    )
+    return result.scalar_one_or_none() is not None
+
+
+async def prune_revoked_tokens(session: AsyncSession) -> int:
+    """Delete revocations of expired tokens, which ``jwt.decode`` rejects by itself."""
+    now = datetime.datetime.now(datetime.timezone.utc)
+    result = await session.execute(delete(RevokedToken).where(RevokedToken.expires_at < now))
+    await session.commit()
+    return result.rowcount
+
+
+def get_revocation_list() -> RevocationList:
+    return revocation_list
+
+
+async def main() -> None:
+    async with database.session_factory() as session:
+        pruned = await prune_revoked_tokens(session)
+    await database.dispose()
+    print(f"{pruned} expired revocation(s) deleted.")
+
+####################################################################################################
+# SETTINGS
+####################################################################################################
+
+revocation_list = RevocationList(
+    capacity=settings.REVOCATION_BLOOM_CAPACITY,
+    error_rate=settings.REVOCATION_BLOOM_ERROR_RATE,
+    cache_size=settings.REVOCATION_CACHE_SIZE,
+    sync_seconds=settings.REVOCATION_SYNC_SECONDS,
+    sync_overlap=settings.REVOCATION_SYNC_OVERLAP,
+    rebuild_seconds=settings.REVOCATION_REBUILD_SECONDS,
+)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,111 @@
+# Python std lib
+import re
+from typing import Sequence
+
+# Third party
+from sqlalchemy import DDL, event, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# Local
+from .models import Book
+
+####################################################################################################
+# SETTINGS
+####################################################################################################
+
+# The search objects live outside of the models, so they are attached to the books table here for
+# ``metadata.create_all`` (tests, local databases); migration 392eca214e3d runs the same statements.
+POSTGRES_SEARCH_DDL = (
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "ALTER TABLE books ADD COLUMN IF NOT EXISTS search_vector tsvector",
+    """
+    CREATE OR REPLACE FUNCTION books_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('simple', coalesce(NEW.title, '')), 'A') ||
+            setweight(to_tsvector('simple', coalesce(NEW.author, '')), 'B') ||
+            setweight(to_tsvector('simple', coalesce(NEW.description, '')), 'C');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    # Only the searchable columns fire the trigger, so stock updates on checkout stay cheap.
+    """
+    CREATE TRIGGER books_search_vector_update
+    BEFORE INSERT OR UPDATE OF title, author, description ON books
+    FOR EACH ROW EXECUTE FUNCTION books_search_vector_update()
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_books_search_vector ON books USING gin (search_vector)",
+    "CREATE INDEX IF NOT EXISTS ix_books_title_trgm ON books USING gin (title gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_books_author_trgm ON books USING gin (author gin_trgm_ops)",
+)
+SQLITE_SEARCH_DDL = (
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+        title, author, description, content='books', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS books_fts_insert AFTER INSERT ON books BEGIN
+        INSERT INTO books_fts (rowid, title, author, description)
+        VALUES (new.id, new.title, new.author, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS books_fts_delete AFTER DELETE ON books BEGIN
+        INSERT INTO books_fts (books_fts, rowid, title, author, description)
+        VALUES ('delete', old.id, old.title, old.author, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS books_fts_update AFTER UPDATE OF title, author, description ON books BEGIN
+        INSERT INTO books_fts (books_fts, rowid, title, author, description)
+        VALUES ('delete', old.id, old.title, old.author, old.description);
+        INSERT INTO books_fts (rowid, title, author, description)
+        VALUES (new.id, new.title, new.author, new.description);
+    END
+    """,
+)
+
+POSTGRES_SEARCH_QUERY = text("""
+    SELECT books.* FROM books, websearch_to_tsquery('simple', :q) AS query
+    WHERE books.search_vector @@ query OR books.title % :q OR books.author % :q
+    ORDER BY
+        ts_rank(books.search_vector, query) + greatest(similarity(books.title, :q), similarity(books.author, :q)) DESC,
+        books.id
+    LIMIT :limit
+""")
+SQLITE_SEARCH_QUERY = text("""
+    SELECT books.* FROM books_fts JOIN books ON books.id = books_fts.rowid
+    WHERE books_fts MATCH :q
+    ORDER BY bm25(books_fts, 10.0, 5.0, 1.0), books.id
+    LIMIT :limit
+""")
+
+for statement in POSTGRES_SEARCH_DDL:
+    event.listen(Book.__table__, "after_create", DDL(statement).execute_if(dialect="postgresql"))
+for statement in SQLITE_SEARCH_DDL:
+    event.listen(Book.__table__, "after_create", DDL(statement).execute_if(dialect="sqlite"))
+event.listen(Book.__table__, "before_drop", DDL("DROP TABLE IF EXISTS books_fts").execute_if(dialect="sqlite"))
+
+####################################################################################################
+# FUNCTIONS
+####################################################################################################
+
+def fts5_query(q: str) -> str:
+    """Turn free text into an FTS5 query: every word must match as a prefix, syntax is escaped."""
+    return " ".join(f'"{word}"*' for word in re.findall(r"\w+", q))
+
+
+async def full_text_search(session: AsyncSession, q: str, limit: int) -> Sequence[Book]:
+    """Rank books by relevance of ``q`` to their title, author and description."""
+    connection = await session.connection()
+    if connection.dialect.name == "postgresql":
+        query, params = POSTGRES_SEARCH_QUERY, {"q": q, "limit": limit}
+    else:
+        match = fts5_query(q)
+        if not match:
+            return []
+        query, params = SQLITE_SEARCH_QUERY, {"q": match, "limit": limit}
+    result = await session.execute(select(Book).from_statement(query), params)
+    return result.scalars().all()
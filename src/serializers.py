@@ -1,8 +1,24 @@
 # Python std lib
 from datetime import date
+from typing import Literal
 
 # Third party
-from pydantic import BaseModel, EmailStr, Field, ConfigDict
+from pydantic import BaseModel, EmailStr, Field, ConfigDict, TypeAdapter, field_validator, model_validator
+from typing_extensions import TypedDict
+
+####################################################################################################
+# FUNCTIONS
+####################################################################################################
+
+def row_list_adapter(schema: type[BaseModel]) -> TypeAdapter:
+    """
+    Serializer for lists of plain dicts with the fields of ``schema``, in the same order.
+
+    The rows come straight from the database, so they are dumped as they are, without building and
+    validating a model per row; the JSON is the same as for a list of ``schema``.
+    """
+    fields = {name: field.annotation for name, field in schema.model_fields.items()}
+    return TypeAdapter(list[TypedDict(f"{schema.__name__}Row", fields)])
 
 ####################################################################################################
 # TOKEN-SCHEMAS
@@ -12,10 +28,6 @@ class RefreshToken(BaseModel):
     refresh_token: str
 
 
-class AccessToken(BaseModel):
-    access_token: str
-
-
 class Tokens(BaseModel):
     refresh_token: str
     access_token: str
@@ -65,6 +77,9 @@ class ReaderResponse(ReaderBase):
 
     model_config = ConfigDict(from_attributes=True)
 
+
+ReaderRowListAdapter = row_list_adapter(ReaderResponse)
+
 ####################################################################################################
 # BOOK SCHEMAS
 ####################################################################################################
@@ -86,6 +101,22 @@ class BookResponse(BookBase):
 
     model_config = ConfigDict(from_attributes=True)
 
+
+BookListAdapter = TypeAdapter(list[BookResponse])
+BookRowListAdapter = row_list_adapter(BookResponse)
+
+
+class BookImportError(BaseModel):
+    row: int
+    errors: list[str]
+
+
+class BookImportResult(BaseModel):
+    processed: int
+    imported: int
+    failed: int
+    errors: list[BookImportError]
+
 ####################################################################################################
 # BORROWED BOOK SCHEMAS
 ####################################################################################################
@@ -98,10 +129,110 @@ class BorrowedBookBase(BaseModel):
 
 
 class BorrowedBookCreate(BorrowedBookBase):
-    pass
+    # A return date is when the copy came back, so it can not lie ahead or before the loan began.
+    @field_validator("return_date")
+    @classmethod
+    def return_date_not_in_future(cls, value: date | None) -> date | None:
+        if value is not None and value > date.today():
+            raise ValueError("return_date can not be in the future")
+        return value
+
+    @model_validator(mode="after")
+    def return_date_not_before_borrowed_date(self) -> "BorrowedBookCreate":
+        if self.return_date is not None and self.return_date < self.borrowed_date:
+            raise ValueError("return_date can not be before borrowed_date")
+        return self
 
 
 class BorrowedBookResponse(BorrowedBookBase):
     id: int
 
-    model_config = ConfigDict(from_attributes=True)
\ No newline at end of file
+    model_config = ConfigDict(from_attributes=True)
+
+
+BorrowedBookRowListAdapter = row_list_adapter(BorrowedBookResponse)
+
+
+class LoanBook(BaseModel):
+    title: str
+    author: str
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class ReaderLoanResponse(BorrowedBookResponse):
+    book: LoanBook
+
+
+ReaderLoanListAdapter = TypeAdapter(list[ReaderLoanResponse])
+
+
+class OverdueLoanResponse(BorrowedBookResponse):
+    days_overdue: int
+    fine: float | None
+
+
+OverdueLoanRowListAdapter = row_list_adapter(OverdueLoanResponse)
+
+
+class BorrowedBooksCheckout(BaseModel):
+    reader_id: int
+    book_ids: list[int] = Field(..., min_length=1, max_length=100)
+    borrowed_date: date = Field(default_factory=date.today)
+    # All-or-nothing by default; otherwise every book that can be lent is, and the rest is reported.
+    atomic: bool = True
+
+
+class BorrowedBookCheckoutStatus(BaseModel):
+    book_id: int
+    status: Literal["borrowed", "not_found", "out_of_stock", "limit_reached"]
+    loan: BorrowedBookResponse | None = None
+
+
+class BorrowedBooksCheckoutResult(BaseModel):
+    borrowed: int
+    results: list[BorrowedBookCheckoutStatus]
+
+
+class BorrowedBooksReturn(BaseModel):
+    ids: list[int] = Field(..., min_length=1, max_length=1000)
+    return_date: date = Field(default_factory=date.today)
+
+    @field_validator("return_date")
+    @classmethod
+    def return_date_not_in_future(cls, value: date) -> date:
+        if value > date.today():
+            raise ValueError("return_date can not be in the future")
+        return value
+
+
+class BorrowedBookReturnStatus(BaseModel):
+    id: int
+    status: Literal["returned", "already_returned", "before_borrowed_date", "not_found"]
+
+
+class BorrowedBooksReturnResult(BaseModel):
+    returned: int
+    results: list[BorrowedBookReturnStatus]
+
+####################################################################################################
+# HEALTH SCHEMAS
+####################################################################################################
+
+class PoolStats(BaseModel):
+    size: int
+    checked_in: int
+    checked_out: int
+    overflow: int
+    waiters: int
+    acquire_count: int
+    acquire_seconds_total: float
+
+
+class PoolStatsResponse(BaseModel):
+    primary: PoolStats
+    replicas: list[PoolStats]
+
+
+class ReadinessResponse(BaseModel):
+    status: Literal["ready", "warming_up"]
@@ -1,11 +1,17 @@
 # Third party
+import pytest
 import pytest_asyncio
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from httpx import AsyncClient, ASGITransport
 
 # Local
-from src.db import Base, get_session
+from src.availability import AvailabilityBroker, get_availability_broker
+from src.cache import MemoryCache, get_cache
+from src.db import Base, get_read_session, get_read_session_factory, get_session
 from src.config import settings
+from src.metrics import instrument_engine
+from src.revocation import RevocationList, get_revocation_list
+from src.ratelimit import MemoryRateLimitStore, create_login_limiter, get_login_limiter
 from src.api.main import app
 from src.api.auth import create_access_token
 from .factories import LibrarianFactory
@@ -15,6 +21,7 @@ from .factories import LibrarianFactory
 ####################################################################################################
 
 engine_test = create_async_engine(settings.get_test_db_url, echo=False)
+instrument_engine(engine_test)
 async_session_test = async_sessionmaker(engine_test, expire_on_commit=False)
 
 ####################################################################################################
@@ -30,6 +37,11 @@ async def prepare_database():
         await conn.run_sync(Base.metadata.drop_all)
 
 
+@pytest.fixture(autouse=True)
+def strict_query_budgets(monkeypatch):
+    monkeypatch.setattr(settings, "DB_QUERY_BUDGET_STRICT", True)
+
+
 @pytest_asyncio.fixture
 async def get_test_session():
     async with async_session_test() as session:
@@ -37,11 +49,39 @@ async def get_test_session():
 
 
 @pytest_asyncio.fixture
-async def async_client(get_test_session):
+async def test_cache():
+    return MemoryCache(maxsize=1000)
+
+
+@pytest_asyncio.fixture
+async def test_broker():
+    return AvailabilityBroker(queue_size=2)
+
+
+@pytest_asyncio.fixture
+async def test_login_limiter():
+    return create_login_limiter(MemoryRateLimitStore(shards=4, max_keys=1000))
+
+
+@pytest_asyncio.fixture
+async def test_revocation_list():
+    return RevocationList(
+        capacity=1000, error_rate=0.01, cache_size=100, sync_seconds=5, sync_overlap=100, rebuild_seconds=3600
+    )
+
+
+@pytest_asyncio.fixture
+async def async_client(get_test_session, test_cache, test_broker, test_login_limiter, test_revocation_list):
     async def override_get_session():
         yield get_test_session
 
     app.dependency_overrides[get_session] = override_get_session
+    app.dependency_overrides[get_read_session] = override_get_session
+    app.dependency_overrides[get_read_session_factory] = lambda: async_session_test
+    app.dependency_overrides[get_cache] = lambda: test_cache
+    app.dependency_overrides[get_availability_broker] = lambda: test_broker
+    app.dependency_overrides[get_login_limiter] = lambda: test_login_limiter
+    app.dependency_overrides[get_revocation_list] = lambda: test_revocation_list
 
     async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
         librarian = LibrarianFactory.build()
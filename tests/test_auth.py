@@ -0,0 +1,191 @@
+# Python std lib
+from datetime import datetime, timedelta, timezone
+
+# Third party
+import pytest
+from httpx import AsyncClient
+from passlib.hash import bcrypt
+from pydantic import ValidationError
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# Local
+from src.api.auth import create_refresh_token
+from src.api.oauth_scheme import token_cache
+from src.config import Settings, settings
+from src.models import Librarian, RevokedToken
+from src.ratelimit import LoginRateLimiter, MemoryRateLimitStore
+from src.revocation import RevocationList
+from .factories import LibrarianFactory
+
+
+####################################################################################################
+# TESTS
+####################################################################################################
+
+
+@pytest.mark.asyncio
+async def test_sign_in_rehashes_outdated_password(async_client: AsyncClient, get_test_session: AsyncSession):
+    outdated_rounds = 4 if settings.BCRYPT_ROUNDS != 4 else 5
+    outdated_hash = bcrypt.using(rounds=outdated_rounds).hash("secret-password")
+    librarian: Librarian = LibrarianFactory.build(password=outdated_hash)
+    get_test_session.add(librarian)
+    await get_test_session.commit()
+
+    response = await async_client.post(
+        "/auth/sign-in", json={"email": librarian.email, "password": "secret-password"}
+    )
+
+    assert response.status_code == 200
+    await get_test_session.refresh(librarian)
+    assert bcrypt.from_string(librarian.password).rounds == settings.BCRYPT_ROUNDS
+    assert bcrypt.verify("secret-password", librarian.password)
+
+
+@pytest.mark.asyncio
+async def test_sign_in_wrong_password(async_client: AsyncClient, get_test_session: AsyncSession):
+    librarian: Librarian = LibrarianFactory.build(password=bcrypt.using(rounds=4).hash("secret-password"))
+    get_test_session.add(librarian)
+    await get_test_session.commit()
+
+    response = await async_client.post(
+        "/auth/sign-in", json={"email": librarian.email, "password": "wrong-password"}
+    )
+
+    assert response.status_code == 401
+    assert response.json()["detail"] == "Incorrect email or password"
+
+
+@pytest.mark.asyncio
+async def test_verify_token_caches_verified_tokens(async_client: AsyncClient):
+    token_cache.clear()
+
+    first_response = await async_client.get("/books/", params={"limit": 1})
+    second_response = await async_client.get("/books/", params={"limit": 1})
+
+    assert first_response.status_code == second_response.status_code == 200
+    assert (token_cache.misses, token_cache.hits) == (1, 1)
+
+
+@pytest.mark.asyncio
+async def test_verify_token_rejects_refresh_token(async_client: AsyncClient):
+    refresh_token = create_refresh_token({"sub": "1"})
+
+    response = await async_client.get("/books/", headers={"Authorization": f"Bearer {refresh_token}"})
+
+    assert response.status_code == 401
+    assert token_cache.get(refresh_token) is None
+
+
+@pytest.mark.asyncio
+async def test_sign_in_rate_limited_by_email(async_client: AsyncClient, test_login_limiter: LoginRateLimiter):
+    credentials = {"email": "stuffed@example.com", "password": "wrong-password"}
+    for _ in range(test_login_limiter.email_burst):
+        response = await async_client.post("/auth/sign-in", json=credentials)
+        assert response.status_code == 401
+
+    response = await async_client.post("/auth/sign-in", json=credentials)
+
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    response = await async_client.post("/auth/sign-in", json={**credentials, "email": "other@example.com"})
+    assert response.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_memory_rate_limit_store_forgets_refilled_buckets():
+    now = 1000.0
+    store = MemoryRateLimitStore(shards=1, max_keys=2, clock=lambda: now)
+
+    assert await store.take("a", rate=1, burst=1) == 0
+    assert await store.take("a", rate=1, burst=1) == 1
+    now += 5
+    assert await store.take("b", rate=1, burst=1) == 0
+    assert len(store) == 1
+    await store.take("c", rate=1, burst=1)
+    await store.take("d", rate=1, burst=1)
+    assert len(store) == 2
+
+
+def test_login_rate_limits_must_be_positive():
+    with pytest.raises(ValidationError):
+        Settings(LOGIN_RATE_LIMIT_EMAIL_PER_MINUTE=0)
+
+
+@pytest.mark.asyncio
+async def test_refresh_token_rotation_rejects_reuse(async_client: AsyncClient):
+    refresh_token = create_refresh_token({"sub": "1"})
+
+    response = await async_client.post("/auth/token", json={"refresh_token": refresh_token})
+    assert response.status_code == 200
+    rotated = response.json()["refresh_token"]
+    assert rotated != refresh_token
+
+    response = await async_client.post("/auth/token", json={"refresh_token": refresh_token})
+    assert response.status_code == 401
+    response = await async_client.post("/auth/token", json={"refresh_token": rotated})
+    assert response.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_revoked_refresh_token_is_rejected(async_client: AsyncClient):
+    refresh_token = create_refresh_token({"sub": "1"})
+
+    for _ in range(2):
+        response = await async_client.post("/auth/revoke", json={"refresh_token": refresh_token})
+        assert response.status_code == 204
+
+    response = await async_client.post("/auth/token", json={"refresh_token": refresh_token})
+    assert response.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_revocation_list_syncs_other_workers_revocations(get_test_session: AsyncSession):
+    revocation_list = RevocationList(
+        capacity=1000, error_rate=0.01, cache_size=100, sync_seconds=0, sync_overlap=10, rebuild_seconds=3600
+    )
+    expires_at = datetime.now(timezone.utc) + timedelta(days=1)
+    get_test_session.add(RevokedToken(jti="revoked-elsewhere", expires_at=expires_at))
+    await get_test_session.commit()
+
+    assert await revocation_list.is_revoked(get_test_session, "revoked-elsewhere")
+    assert not await revocation_list.is_revoked(get_test_session, "never-revoked")
+    assert revocation_list.lookups == 0
+
+
+@pytest.mark.asyncio
+async def test_revocation_list_rebuild_forgets_pruned_revocations(get_test_session: AsyncSession):
+    revocation_list = RevocationList(
+        capacity=1000, error_rate=0.01, cache_size=100, sync_seconds=0, sync_overlap=10, rebuild_seconds=0
+    )
+    expires_at = datetime.now(timezone.utc) + timedelta(days=1)
+    token = RevokedToken(jti="pruned-later", expires_at=expires_at)
+    get_test_session.add(token)
+    await get_test_session.commit()
+    await revocation_list.sync(get_test_session)
+    assert "pruned-later" in revocation_list.bloom
+
+    await get_test_session.delete(token)
+    await get_test_session.commit()
+    await revocation_list.sync(get_test_session)
+
+    assert "pruned-later" not in revocation_list.bloom
+
+
+@pytest.mark.asyncio
+async def test_revocation_list_syncs_late_committed_revocations(get_test_session: AsyncSession):
+    revocation_list = RevocationList(
+        capacity=1000, error_rate=0.01, cache_size=100, sync_seconds=0, sync_overlap=10, rebuild_seconds=3600
+    )
+    expires_at = datetime.now(timezone.utc) + timedelta(days=1)
+    last_id = await get_test_session.scalar(select(func.coalesce(func.max(RevokedToken.id), 0)))
+    get_test_session.add(RevokedToken(id=last_id + 5, jti="committed-first", expires_at=expires_at))
+    await get_test_session.commit()
+    assert await revocation_list.is_revoked(get_test_session, "committed-first")
+
+    # Took its id earlier, but committed after the sync above.
+    get_test_session.add(RevokedToken(id=last_id + 3, jti="committed-late", expires_at=expires_at))
+    await get_test_session.commit()
+
+    assert await revocation_list.is_revoked(get_test_session, "committed-late")
+    assert revocation_list.lookups == 0
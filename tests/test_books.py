@@ -0,0 +1,355 @@
+# Python std lib
+import asyncio
+import csv
+import io
+import json
+
+# Third party
+import pytest
+from httpx import AsyncClient
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+# Local
+from src.api.books import stream_availability
+from src.api.pagination import NEXT_CURSOR_HEADER, encode_cursor
+from src.availability import AvailabilityBroker, PostgresNotifyBridge, notify_payloads
+from src.cache import MemoryCache
+from src.models import Book
+from src.serializers import BookCreate, BookListAdapter
+from .factories import BookFactory, ReaderFactory
+
+
+####################################################################################################
+# TESTS
+####################################################################################################
+
+
+@pytest.mark.asyncio
+async def test_list_books_cursor_pagination(async_client: AsyncClient, get_test_session: AsyncSession):
+    books = BookFactory.build_batch(5)
+    get_test_session.add_all(books)
+    await get_test_session.commit()
+
+    seen_ids: list[int] = []
+    cursor: str | None = None
+    while True:
+        params = {"limit": 2, "cursor": cursor} if cursor else {"limit": 2}
+        response = await async_client.get("/books/", params=params)
+        assert response.status_code == 200
+        seen_ids.extend(book["id"] for book in response.json())
+        cursor = response.headers.get(NEXT_CURSOR_HEADER)
+        if cursor is None:
+            break
+
+    assert seen_ids == sorted(set(seen_ids))
+    assert {book.id for book in books} <= set(seen_ids)
+
+
+@pytest.mark.asyncio
+async def test_list_books_cursor_pagination_by_title(async_client: AsyncClient, get_test_session: AsyncSession):
+    books = [BookFactory.build(title="Same title") for _ in range(3)]
+    get_test_session.add_all(books)
+    await get_test_session.commit()
+
+    first_page = await async_client.get("/books/", params={"limit": 1, "sort": "title"})
+    cursor = first_page.headers[NEXT_CURSOR_HEADER]
+    second_page = await async_client.get("/books/", params={"limit": 1, "sort": "title", "cursor": cursor})
+
+    assert second_page.status_code == 200
+    assert (first_page.json()[0]["title"], first_page.json()[0]["id"]) < (
+        second_page.json()[0]["title"], second_page.json()[0]["id"]
+    )
+
+
+@pytest.mark.asyncio
+async def test_list_books_matches_model_serialization(async_client: AsyncClient, get_test_session: AsyncSession):
+    get_test_session.add_all([BookFactory.build(published_year=None, isbn=None), *BookFactory.build_batch(3)])
+    await get_test_session.commit()
+
+    response = await async_client.get("/books/", params={"limit": 500})
+    books = (await get_test_session.execute(select(Book).order_by(Book.id).limit(500))).scalars().all()
+
+    assert response.content == BookListAdapter.dump_json(BookListAdapter.validate_python(books, from_attributes=True))
+
+
+@pytest.mark.asyncio
+async def test_list_books_rejects_foreign_cursor(async_client: AsyncClient, get_test_session: AsyncSession):
+    get_test_session.add_all(BookFactory.build_batch(2))
+    await get_test_session.commit()
+
+    response = await async_client.get("/books/", params={"limit": 1})
+    cursor = response.headers[NEXT_CURSOR_HEADER]
+
+    response = await async_client.get("/books/", params={"limit": 1, "sort": "author", "cursor": cursor})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor"
+
+
+@pytest.mark.asyncio
+async def test_list_books_rejects_cursor_of_wrong_type(async_client: AsyncClient):
+    for sort, cursor in (("title", encode_cursor("title", 5, 1)), ("id", encode_cursor("id", 0, True))):
+        response = await async_client.get("/books/", params={"sort": sort, "cursor": cursor})
+        assert response.status_code == 400
+        assert response.json()["detail"] == "Invalid cursor"
+
+
+@pytest.mark.asyncio
+async def test_list_books_legacy_offset_pagination(async_client: AsyncClient, get_test_session: AsyncSession):
+    get_test_session.add_all(BookFactory.build_batch(3))
+    await get_test_session.commit()
+
+    response = await async_client.get("/books/", params={"skip": 1, "limit": 2})
+
+    assert response.status_code == 200
+    assert len(response.json()) == 2
+    assert NEXT_CURSOR_HEADER not in response.headers
+
+
+@pytest.mark.asyncio
+async def test_bulk_import_books_csv_upserts_by_isbn(async_client: AsyncClient, get_test_session: AsyncSession):
+    book = BookFactory.build(isbn="9780000000101", quantity=1)
+    get_test_session.add(book)
+    await get_test_session.commit()
+
+    body = (
+        "title,author,published_year,isbn,quantity\n"
+        '"Updated, title",Author One,2001,9780000000101,7\n'
+        '"Multi\nline",Author Two,,9780000000102,2\n'
+        "Broken,Author Three,,9780000000103,-1\n"
+    )
+    response = await async_client.post("/books/bulk", content=body, headers={"Content-Type": "text/csv"})
+
+    assert response.status_code == 200
+    assert response.json()["processed"] == 3
+    assert response.json()["imported"] == 2
+    assert response.json()["errors"][0]["row"] == 3
+
+    result = await get_test_session.execute(
+        select(Book.title, Book.quantity).where(Book.isbn.in_(["9780000000101", "9780000000102"])).order_by(Book.isbn)
+    )
+    assert result.all() == [("Updated, title", 7), ("Multi\nline", 2)]
+
+
+@pytest.mark.asyncio
+async def test_bulk_import_books_ndjson(async_client: AsyncClient, get_test_session: AsyncSession):
+    body = (
+        '{"title": "First", "author": "Author", "isbn": "9780000000201", "quantity": 1}\n'
+        "not json\n"
+        '{"title": "Second", "author": "Author", "isbn": "9780000000202", "quantity": 2}'
+    )
+    response = await async_client.post(
+        "/books/bulk", content=body, headers={"Content-Type": "application/x-ndjson"}
+    )
+
+    assert response.status_code == 200
+    assert response.json()["imported"] == 2
+    assert response.json()["failed"] == 1
+    assert response.json()["errors"][0]["row"] == 2
+
+
+@pytest.mark.asyncio
+async def test_bulk_import_books_reports_unreadable_rows(async_client: AsyncClient):
+    body = (
+        b"title,author,published_year,isbn,quantity\n"
+        b"Same,Author,,9780000000301,1\n"
+        b"Same again,Author,,9780000000301,2\n"
+        b"Caf\xe9,Author,,9780000000302,1\n"
+        b'"Unclosed,Author,,9780000000303,1\n'
+    )
+    response = await async_client.post("/books/bulk", content=body, headers={"Content-Type": "text/csv"})
+
+    assert response.status_code == 200
+    assert response.json()["processed"] == 4
+    assert response.json()["imported"] == 1
+    assert response.json()["failed"] == 2
+    assert response.json()["errors"] == [
+        {"row": 3, "errors": ["Row is not valid UTF-8"]},
+        {"row": 4, "errors": ["Quoted cell is not closed before the end of the file"]},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_export_books_streams_every_book(async_client: AsyncClient, get_test_session: AsyncSession):
+    books = BookFactory.build_batch(3)
+    get_test_session.add_all(books)
+    await get_test_session.commit()
+
+    response = await async_client.get("/books/export", params={"batch_size": 2})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    exported_ids = [json.loads(line)["id"] for line in response.text.splitlines()]
+    assert {book.id for book in books} <= set(exported_ids)
+    assert exported_ids == sorted(exported_ids)
+
+    response = await async_client.get("/books/export", params={"format": "csv"})
+    assert response.status_code == 200
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [int(row["id"]) for row in rows] == exported_ids
+
+
+@pytest.mark.asyncio
+async def test_get_book_is_cached_until_updated(
+    async_client: AsyncClient, get_test_session: AsyncSession, test_cache: MemoryCache
+):
+    book: Book = BookFactory.build(title="Cached title")
+    get_test_session.add(book)
+    await get_test_session.commit()
+
+    response = await async_client.get(f"/books/{book.id}")
+    assert response.json()["title"] == "Cached title"
+
+    await get_test_session.execute(update(Book).where(Book.id == book.id).values(title="Changed behind the cache"))
+    await get_test_session.commit()
+    response = await async_client.get(f"/books/{book.id}")
+    assert response.json()["title"] == "Cached title"
+    assert test_cache.hits == 1
+
+    updated_book = {**BookCreate.model_validate(book, from_attributes=True).model_dump(), "title": "Updated title"}
+    response = await async_client.put(f"/books/{book.id}", json=updated_book)
+    assert response.status_code == 200
+    response = await async_client.get(f"/books/{book.id}")
+    assert response.json()["title"] == "Updated title"
+
+
+@pytest.mark.asyncio
+async def test_get_book_conditional_request(async_client: AsyncClient, get_test_session: AsyncSession):
+    book: Book = BookFactory.build()
+    get_test_session.add(book)
+    await get_test_session.commit()
+
+    response = await async_client.get(f"/books/{book.id}")
+    etag = response.headers["ETag"]
+
+    response = await async_client.get(f"/books/{book.id}", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["ETag"] == etag
+
+    response = await async_client.get(f"/books/{book.id}", headers={"If-None-Match": '"outdated"'})
+    assert response.status_code == 200
+    assert response.json()["id"] == book.id
+
+
+@pytest.mark.asyncio
+async def test_list_books_conditional_request(async_client: AsyncClient, get_test_session: AsyncSession):
+    get_test_session.add_all(BookFactory.build_batch(2))
+    await get_test_session.commit()
+
+    response = await async_client.get("/books/", params={"limit": 1})
+    etag = response.headers["ETag"]
+
+    response = await async_client.get("/books/", params={"limit": 1}, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert NEXT_CURSOR_HEADER in response.headers
+
+
+@pytest.mark.asyncio
+async def test_search_books(async_client: AsyncClient, get_test_session: AsyncSession):
+    by_title: Book = BookFactory.build(title="Quantum gardening handbook", author="Jane Roe")
+    by_author: Book = BookFactory.build(title="Unrelated", author="Quantina Gardenson")
+    get_test_session.add_all([by_title, by_author])
+    await get_test_session.commit()
+
+    response = await async_client.get("/books/search", params={"q": "quantum gardening"})
+    assert response.status_code == 200
+    assert response.json()[0]["id"] == by_title.id
+    assert by_author.id not in {book["id"] for book in response.json()}
+
+    response = await async_client.get("/books/search", params={"q": "Quant garden"})
+    assert {by_title.id, by_author.id} <= {book["id"] for book in response.json()}
+
+    await async_client.put(
+        f"/books/{by_title.id}",
+        json={**BookCreate.model_validate(by_title, from_attributes=True).model_dump(), "title": "Renamed"},
+    )
+    response = await async_client.get("/books/search", params={"q": "quantum"})
+    assert by_title.id not in {book["id"] for book in response.json()}
+
+
+@pytest.mark.asyncio
+async def test_availability_broker_drops_oldest_for_slow_subscriber():
+    broker = AvailabilityBroker(queue_size=2)
+    slow, other = broker.subscribe(), broker.subscribe()
+    broker.unsubscribe(other)
+
+    await broker.publish([(1, 3), (2, 0), (1, 2)])
+
+    assert [slow.get_nowait() for _ in range(slow.qsize())] == [(2, 0), (1, 2)]
+    assert other.empty()
+    assert broker.dropped == 1
+
+
+@pytest.mark.asyncio
+async def test_stream_availability_sends_snapshot_then_changes(get_test_session: AsyncSession):
+    books = BookFactory.build_batch(2, quantity=4)
+    get_test_session.add_all(books)
+    await get_test_session.commit()
+    watched, other = books[0].id, books[1].id
+    broker = AvailabilityBroker(queue_size=10)
+
+    stream = stream_availability(broker, async_sessionmaker(get_test_session.bind), {watched})
+    assert await anext(stream) == f'event: availability\ndata: {{"book_id": {watched}, "quantity": 4}}\n\n'
+    await broker.publish([(other, 1), (watched, 3)])
+    assert await anext(stream) == f'event: availability\ndata: {{"book_id": {watched}, "quantity": 3}}\n\n'
+
+    await stream.aclose()
+    assert broker.subscribers == 0
+
+
+@pytest.mark.asyncio
+async def test_stream_availability_ends_when_subscribers_are_closed(get_test_session: AsyncSession):
+    broker = AvailabilityBroker(queue_size=10)
+    stream = stream_availability(broker, async_sessionmaker(get_test_session.bind), None)
+    next_event = asyncio.ensure_future(anext(stream))
+    await asyncio.sleep(0)
+    assert broker.subscribers == 1
+
+    broker.close_subscribers()
+
+    with pytest.raises(StopAsyncIteration):
+        await next_event
+    assert broker.subscribers == 0
+
+
+def test_notify_payloads_stay_under_the_limit():
+    changes = [(book_id, 1000) for book_id in range(1, 2001)]
+
+    payloads = list(notify_payloads(changes, limit=1000))
+
+    assert len(payloads) > 1
+    assert all(len(payload) < 1000 for payload in payloads)
+    assert [tuple(change) for payload in payloads for change in json.loads(payload)] == changes
+
+
+@pytest.mark.asyncio
+async def test_stream_availability_reports_unreachable_bridge(
+    async_client: AsyncClient, test_broker: AvailabilityBroker
+):
+    test_broker.bridge = PostgresNotifyBridge(test_broker, "postgresql://127.0.0.1:1/library", "availability")
+
+    response = await async_client.get("/books/availability/stream")
+    assert response.status_code == 503
+    assert test_broker.subscribers == 0
+
+
+@pytest.mark.asyncio
+async def test_checkout_publishes_availability(
+    async_client: AsyncClient, get_test_session: AsyncSession, test_broker: AvailabilityBroker
+):
+    book: Book = BookFactory.build(quantity=2)
+    reader = ReaderFactory.build()
+    get_test_session.add_all([book, reader])
+    await get_test_session.commit()
+    book_id, reader_id = book.id, reader.id
+    queue = test_broker.subscribe()
+
+    response = await async_client.post(
+        "/borrowed_books/checkout", json={"reader_id": reader_id, "book_ids": [book_id]}
+    )
+    assert response.status_code == 201
+    loan_id = response.json()["results"][0]["loan"]["id"]
+    response = await async_client.post("/borrowed_books/return", json={"ids": [loan_id]})
+    assert response.status_code == 200
+
+    assert [queue.get_nowait() for _ in range(queue.qsize())] == [(book_id, 1), (book_id, 2)]
@@ -1,13 +1,18 @@
 # Python std lib
-from datetime import date
+import sys
+from datetime import date, timedelta
 
 # Third party
 import pytest
 from httpx import AsyncClient
+from sqlalchemy import func, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 # Local
+from src.api.pagination import NEXT_CURSOR_HEADER
+from src.availability import AvailabilityBroker
 from src.models import Book, Reader, BorrowedBook
+from src.reconcile import reconcile_active_loans
 from .factories import ReaderFactory, BookFactory
 
 
@@ -56,16 +61,12 @@ async def test_create_borrowed_book_failure_borrowed_books_limit(
     await get_test_session.refresh(book)
     await get_test_session.refresh(reader)
 
-    for i in range(3):
-        borrowed_book = BorrowedBook(
-            book_id=book.id,
-            reader_id=reader.id,
-            borrowed_date=date(2025, 5, 25),
-            return_date=None
+    book_id = book.id
+    for _ in range(3):
+        response = await async_client.post(
+            "/borrowed_books/", json={"book_id": book.id, "reader_id": reader.id, "borrowed_date": "2025-05-25"}
         )
-        get_test_session.add(borrowed_book)
-
-    await get_test_session.commit()
+        assert response.status_code == 201
 
     new_borrowed_book_data = {
         "book_id": book.id,
@@ -79,6 +80,463 @@ async def test_create_borrowed_book_failure_borrowed_books_limit(
     assert response.json()["detail"] == (
         "The reader has already taken the maximum number of books (3) and has not returned them."
     )
+    assert await get_test_session.scalar(select(Book.quantity).where(Book.id == book_id)) == 2
+
+
+@pytest.mark.asyncio
+async def test_create_borrowed_book_success_decrements_quantity(
+    async_client: AsyncClient, get_test_session: AsyncSession
+):
+    book: Book = BookFactory.build(quantity=2)
+    get_test_session.add(book)
+
+    reader: Reader = ReaderFactory.build()
+    get_test_session.add(reader)
+
+    await get_test_session.commit()
+    await get_test_session.refresh(book)
+    await get_test_session.refresh(reader)
+
+    borrowed_book_data = {
+        "book_id": book.id,
+        "reader_id": reader.id,
+        "borrowed_date": "2025-05-25",
+    }
+
+    response = await async_client.post("/borrowed_books/", json=borrowed_book_data)
+
+    assert response.status_code == 201
+    assert response.json()["book_id"] == book.id
+    assert await get_test_session.scalar(select(Book.quantity).where(Book.id == book.id)) == 1
+
+
+@pytest.mark.asyncio
+async def test_create_borrowed_book_failure_reader_not_found(
+    async_client: AsyncClient, get_test_session: AsyncSession
+):
+    book: Book = BookFactory.build(quantity=2)
+    get_test_session.add(book)
+    await get_test_session.commit()
+    await get_test_session.refresh(book)
+
+    book_id = book.id
+    borrowed_book_data = {
+        "book_id": book_id,
+        "reader_id": 0,
+        "borrowed_date": "2025-05-25",
+    }
+
+    response = await async_client.post("/borrowed_books/", json=borrowed_book_data)
+
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Reader is not found."
+    assert await get_test_session.scalar(select(Book.quantity).where(Book.id == book_id)) == 2
+
+
+@pytest.mark.asyncio
+async def test_create_borrowed_book_reports_book_before_reader(
+    async_client: AsyncClient, get_test_session: AsyncSession
+):
+    book: Book = BookFactory.build(quantity=0)
+    get_test_session.add(book)
+    await get_test_session.commit()
+    book_id = book.id
+
+    loan = {"book_id": 0, "reader_id": 0, "borrowed_date": "2025-05-25"}
+    response = await async_client.post("/borrowed_books/", json=loan)
+    assert (response.status_code, response.json()["detail"]) == (404, "Book is not found.")
+
+    response = await async_client.post("/borrowed_books/", json={**loan, "book_id": book_id})
+    assert (response.status_code, response.json()["detail"]) == (400, "Book is out of stock.")
+
+    response = await async_client.post("/borrowed_books/checkout", json={"reader_id": 0, "book_ids": [book_id]})
+    assert (response.status_code, response.json()["detail"]) == (400, "Book is out of stock.")
 
 
+@pytest.mark.asyncio
+async def test_return_borrowed_book_releases_loan_once(async_client: AsyncClient, get_test_session: AsyncSession):
+    book: Book = BookFactory.build(quantity=1)
+    reader: Reader = ReaderFactory.build()
+    get_test_session.add_all([book, reader])
+    await get_test_session.commit()
+    book_id, reader_id = book.id, reader.id
+
+    loan = {"book_id": book_id, "reader_id": reader_id, "borrowed_date": "2025-05-25"}
+    response = await async_client.post("/borrowed_books/", json=loan)
+    assert response.status_code == 201
+    loan_id = response.json()["id"]
+    assert await get_test_session.scalar(select(Reader.active_loans).where(Reader.id == reader_id)) == 1
+
+    for _ in range(2):
+        response = await async_client.put(f"/borrowed_books/{loan_id}", json={**loan, "return_date": "2025-05-26"})
+        assert response.status_code == 200
+
+    get_test_session.expire_all()
+    assert await get_test_session.scalar(select(Reader.active_loans).where(Reader.id == reader_id)) == 0
+    assert await get_test_session.scalar(select(Book.quantity).where(Book.id == book_id)) == 1
+
+
+@pytest.mark.asyncio
+async def test_create_borrowed_book_rejects_return_date(async_client: AsyncClient):
+    loan = {"book_id": 1, "reader_id": 1, "borrowed_date": "2025-05-25", "return_date": "2025-05-26"}
+
+    response = await async_client.post("/borrowed_books/", json=loan)
+
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_update_borrowed_book_rejects_impossible_return_date(async_client: AsyncClient):
+    loan = {"book_id": 1, "reader_id": 1, "borrowed_date": "2025-05-25"}
+
+    for return_date in ("2999-01-01", "2020-01-01"):
+        response = await async_client.put("/borrowed_books/1", json={**loan, "return_date": return_date})
+        assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_delete_active_borrowed_book_restocks_book(
+    async_client: AsyncClient, get_test_session: AsyncSession, test_broker: AvailabilityBroker
+):
+    book: Book = BookFactory.build(quantity=1)
+    reader: Reader = ReaderFactory.build()
+    get_test_session.add_all([book, reader])
+    await get_test_session.commit()
+    book_id, reader_id = book.id, reader.id
+    response = await async_client.post(
+        "/borrowed_books/", json={"book_id": book_id, "reader_id": reader_id, "borrowed_date": "2025-05-25"}
+    )
+    loan_id = response.json()["id"]
+    queue = test_broker.subscribe()
+
+    response = await async_client.delete(f"/borrowed_books/{loan_id}")
+
+    assert response.status_code == 204
+    assert queue.get_nowait() == (book_id, 1)
+    get_test_session.expire_all()
+    assert await get_test_session.scalar(select(Book.quantity).where(Book.id == book_id)) == 1
+    assert await get_test_session.scalar(select(Reader.active_loans).where(Reader.id == reader_id)) == 0
+
+
+@pytest.mark.asyncio
+async def test_update_borrowed_book_reopening_takes_loan_again(
+    async_client: AsyncClient, get_test_session: AsyncSession
+):
+    book: Book = BookFactory.build(quantity=1)
+    reader: Reader = ReaderFactory.build()
+    get_test_session.add_all([book, reader])
+    await get_test_session.commit()
+    book_id, reader_id = book.id, reader.id
+
+    loan = {"book_id": book_id, "reader_id": reader_id, "borrowed_date": "2025-05-25"}
+    response = await async_client.post("/borrowed_books/", json=loan)
+    loan_id = response.json()["id"]
+    await async_client.put(f"/borrowed_books/{loan_id}", json={**loan, "return_date": "2025-05-26"})
+
+    response = await async_client.put(f"/borrowed_books/{loan_id}", json={**loan, "return_date": None})
+
+    assert response.status_code == 200
+    get_test_session.expire_all()
+    assert await get_test_session.scalar(select(Reader.active_loans).where(Reader.id == reader_id)) == 1
+    assert await get_test_session.scalar(select(Book.quantity).where(Book.id == book_id)) == 0
+
+
+@pytest.mark.asyncio
+async def test_reconcile_active_loans(get_test_session: AsyncSession):
+    book: Book = BookFactory.build(quantity=5)
+    reader: Reader = ReaderFactory.build(active_loans=3)
+    get_test_session.add_all([book, reader])
+    await get_test_session.commit()
+    reader_id = reader.id
+    get_test_session.add_all([
+        BorrowedBook(book_id=book.id, reader_id=reader_id, borrowed_date=date(2025, 5, 25)),
+        BorrowedBook(
+            book_id=book.id, reader_id=reader_id, borrowed_date=date(2025, 5, 25), return_date=date(2025, 6, 1)
+        ),
+    ])
+    await get_test_session.commit()
+
+    drifted = await reconcile_active_loans(get_test_session)
+
+    assert (reader_id, 3, 1) in [tuple(row) for row in drifted]
+    get_test_session.expire_all()
+    assert await get_test_session.scalar(select(Reader.active_loans).where(Reader.id == reader_id)) == 1
+
+
+@pytest.mark.asyncio
+async def test_return_borrowed_books_batch(async_client: AsyncClient, get_test_session: AsyncSession):
+    book: Book = BookFactory.build(quantity=3)
+    reader: Reader = ReaderFactory.build()
+    get_test_session.add_all([book, reader])
+    await get_test_session.commit()
+    book_id, reader_id = book.id, reader.id
+
+    loan_ids = []
+    for _ in range(3):
+        response = await async_client.post(
+            "/borrowed_books/", json={"book_id": book_id, "reader_id": reader_id, "borrowed_date": "2025-05-25"}
+        )
+        loan_ids.append(response.json()["id"])
+    await async_client.post("/borrowed_books/return", json={"ids": [loan_ids[2]]})
+
+    response = await async_client.post(
+        "/borrowed_books/return", json={"ids": [*loan_ids, loan_ids[0], 0], "return_date": "2025-06-01"}
+    )
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "returned": 2,
+        "results": [
+            {"id": loan_ids[0], "status": "returned"},
+            {"id": loan_ids[1], "status": "returned"},
+            {"id": loan_ids[2], "status": "already_returned"},
+            {"id": 0, "status": "not_found"},
+        ],
+    }
+    get_test_session.expire_all()
+    assert await get_test_session.scalar(select(Book.quantity).where(Book.id == book_id)) == 3
+    assert await get_test_session.scalar(select(Reader.active_loans).where(Reader.id == reader_id)) == 0
+    loan = await get_test_session.get(BorrowedBook, loan_ids[0])
+    assert loan.return_date == date(2025, 6, 1)
+
+
+@pytest.mark.asyncio
+async def test_return_borrowed_books_before_borrowed_date(async_client: AsyncClient, get_test_session: AsyncSession):
+    book: Book = BookFactory.build(quantity=1)
+    reader: Reader = ReaderFactory.build()
+    get_test_session.add_all([book, reader])
+    await get_test_session.commit()
+    book_id, reader_id = book.id, reader.id
+    response = await async_client.post(
+        "/borrowed_books/", json={"book_id": book_id, "reader_id": reader_id, "borrowed_date": "2025-06-05"}
+    )
+    loan_id = response.json()["id"]
+
+    response = await async_client.post("/borrowed_books/return", json={"ids": [loan_id], "return_date": "2025-06-01"})
+
+    assert response.json() == {"returned": 0, "results": [{"id": loan_id, "status": "before_borrowed_date"}]}
+    get_test_session.expire_all()
+    assert await get_test_session.scalar(select(Book.quantity).where(Book.id == book_id)) == 0
+    assert (await get_test_session.get(BorrowedBook, loan_id)).return_date is None
+
+
+@pytest.mark.asyncio
+async def test_return_borrowed_books_rejects_future_date(async_client: AsyncClient):
+    response = await async_client.post("/borrowed_books/return", json={"ids": [1], "return_date": "2999-01-01"})
+
+    assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_checkout_borrowed_books_per_item(async_client: AsyncClient, get_test_session: AsyncSession):
+    in_stock: Book = BookFactory.build(quantity=1)
+    out_of_stock: Book = BookFactory.build(quantity=0)
+    reader: Reader = ReaderFactory.build()
+    get_test_session.add_all([in_stock, out_of_stock, reader])
+    await get_test_session.commit()
+    in_stock_id, out_of_stock_id, reader_id = in_stock.id, out_of_stock.id, reader.id
+
+    response = await async_client.post(
+        "/borrowed_books/checkout",
+        json={"reader_id": reader_id, "book_ids": [in_stock_id, in_stock_id, out_of_stock_id, 0], "atomic": False},
+    )
+
+    assert response.status_code == 201
+    body = response.json()
+    assert body["borrowed"] == 1
+    assert [(item["book_id"], item["status"]) for item in body["results"]] == [
+        (in_stock_id, "borrowed"),
+        (in_stock_id, "out_of_stock"),
+        (out_of_stock_id, "out_of_stock"),
+        (0, "not_found"),
+    ]
+    assert body["results"][0]["loan"]["reader_id"] == reader_id
+    get_test_session.expire_all()
+    assert await get_test_session.scalar(select(Book.quantity).where(Book.id == in_stock_id)) == 0
+    assert await get_test_session.scalar(select(Reader.active_loans).where(Reader.id == reader_id)) == 1
+
+
+@pytest.mark.asyncio
+async def test_checkout_borrowed_books_same_book_keeps_request_order(
+    async_client: AsyncClient, get_test_session: AsyncSession
+):
+    book: Book = BookFactory.build(quantity=2)
+    reader: Reader = ReaderFactory.build()
+    get_test_session.add_all([book, reader])
+    await get_test_session.commit()
+    book_id, reader_id = book.id, reader.id
+
+    response = await async_client.post(
+        "/borrowed_books/checkout", json={"reader_id": reader_id, "book_ids": [book_id, book_id]}
+    )
+
+    assert response.status_code == 201
+    loan_ids = [item["loan"]["id"] for item in response.json()["results"]]
+    assert loan_ids == sorted(loan_ids)
+
+
+@pytest.mark.asyncio
+async def test_checkout_borrowed_books_nothing_lent(async_client: AsyncClient, get_test_session: AsyncSession):
+    out_of_stock: Book = BookFactory.build(quantity=0)
+    reader: Reader = ReaderFactory.build()
+    get_test_session.add_all([out_of_stock, reader])
+    await get_test_session.commit()
+    out_of_stock_id, reader_id = out_of_stock.id, reader.id
+
+    response = await async_client.post(
+        "/borrowed_books/checkout",
+        json={"reader_id": reader_id, "book_ids": [out_of_stock_id, 0], "atomic": False},
+    )
+
+    assert response.status_code == 409
+    assert response.json()["borrowed"] == 0
+    assert [item["status"] for item in response.json()["results"]] == ["out_of_stock", "not_found"]
+
+
+@pytest.mark.asyncio
+async def test_checkout_borrowed_books_atomic_limit(async_client: AsyncClient, get_test_session: AsyncSession):
+    books = BookFactory.build_batch(4, quantity=5)
+    reader: Reader = ReaderFactory.build()
+    get_test_session.add_all([*books, reader])
+    await get_test_session.commit()
+    book_ids, reader_id = [book.id for book in books], reader.id
+
+    response = await async_client.post(
+        "/borrowed_books/checkout", json={"reader_id": reader_id, "book_ids": book_ids}
+    )
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == (
+        "The reader has already taken the maximum number of books (3) and has not returned them."
+    )
+    assert await get_test_session.scalar(select(Reader.active_loans).where(Reader.id == reader_id)) == 0
+    assert await get_test_session.scalar(select(func.count()).where(BorrowedBook.reader_id == reader_id)) == 0
+
+    response = await async_client.post(
+        "/borrowed_books/checkout", json={"reader_id": reader_id, "book_ids": book_ids[:3]}
+    )
+
+    assert response.status_code == 201
+    assert response.json()["borrowed"] == 3
+    get_test_session.expire_all()
+    assert await get_test_session.scalar(select(Reader.active_loans).where(Reader.id == reader_id)) == 3
+
+
+@pytest.mark.asyncio
+async def test_list_overdue_loans(async_client: AsyncClient, get_test_session: AsyncSession):
+    book: Book = BookFactory.build(quantity=5)
+    reader: Reader = ReaderFactory.build()
+    get_test_session.add_all([book, reader])
+    await get_test_session.commit()
+    today = date.today()
+    loans = [
+        BorrowedBook(book_id=book.id, reader_id=reader.id, borrowed_date=today - timedelta(days=days))
+        for days in (30, 20, 20, 5)
+    ]
+    loans.append(
+        BorrowedBook(book_id=book.id, reader_id=reader.id, borrowed_date=today - timedelta(days=40), return_date=today)
+    )
+    get_test_session.add_all(loans)
+    await get_test_session.commit()
+    loan_ids = [loan.id for loan in loans]
+
+    overdue, cursor = [], None
+    while True:
+        params = {"limit": 2, "loan_days": 14, "fine_per_day": 0.5, **({"cursor": cursor} if cursor else {})}
+        response = await async_client.get("/borrowed_books/overdue", params=params)
+        assert response.status_code == 200
+        overdue += [loan for loan in response.json() if loan["id"] in loan_ids]
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+
+    assert [(loan["id"], loan["days_overdue"], loan["fine"]) for loan in overdue] == [
+        (loan_ids[0], 16, 8.0), (loan_ids[1], 6, 3.0), (loan_ids[2], 6, 3.0)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_list_reader_loans(async_client: AsyncClient, get_test_session: AsyncSession):
+    book: Book = BookFactory.build(quantity=5)
+    reader: Reader = ReaderFactory.build()
+    get_test_session.add_all([book, reader])
+    await get_test_session.commit()
+    book_id, reader_id, title, author = book.id, reader.id, book.title, book.author
+    get_test_session.add_all([
+        BorrowedBook(book_id=book_id, reader_id=reader_id, borrowed_date=date(2025, 5, 20)),
+        BorrowedBook(
+            book_id=book_id, reader_id=reader_id, borrowed_date=date(2025, 5, 25), return_date=date(2025, 6, 1)
+        ),
+    ])
+    await get_test_session.commit()
+
+    response = await async_client.get(f"/readers/{reader_id}/loans")
+
+    assert response.status_code == 200
+    loans = response.json()
+    assert [loan["borrowed_date"] for loan in loans] == ["2025-05-25", "2025-05-20"]
+    assert loans[0]["book"] == {"title": title, "author": author}
+
+    response = await async_client.get(f"/readers/{reader_id}/loans", params={"limit": 1})
+    assert [loan["borrowed_date"] for loan in response.json()] == ["2025-05-25"]
+    response = await async_client.get(
+        f"/readers/{reader_id}/loans", params={"limit": 1, "cursor": response.headers[NEXT_CURSOR_HEADER]}
+    )
+    assert [loan["borrowed_date"] for loan in response.json()] == ["2025-05-20"]
+    assert NEXT_CURSOR_HEADER not in response.headers
+
+    response = await async_client.get(f"/readers/{reader_id}/loans", params={"status": "active"})
+    assert [loan["return_date"] for loan in response.json()] == [None]
+
+    response = await async_client.get(f"/readers/{reader_id}/loans", params={"status": "returned"})
+    assert [loan["return_date"] for loan in response.json()] == ["2025-06-01"]
+
+    response = await async_client.get("/readers/0/loans")
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("columnar_format, year", [("arrow", 2001), ("parquet", 2002)])
+async def test_export_loan_history_columnar(
+    async_client: AsyncClient, get_test_session: AsyncSession, columnar_format: str, year: int
+):
+    pa = pytest.importorskip("pyarrow")
+    import pyarrow.ipc
+    import pyarrow.parquet
+
+    book: Book = BookFactory.build(quantity=5)
+    reader: Reader = ReaderFactory.build()
+    get_test_session.add_all([book, reader])
+    await get_test_session.commit()
+    loans = [
+        BorrowedBook(book_id=book.id, reader_id=reader.id, borrowed_date=date(year, 1, day), return_date=returned)
+        for day, returned in ((10, date(year, 1, 20)), (15, None), (25, None))
+    ]
+    get_test_session.add_all(loans)
+    await get_test_session.commit()
+    loan_ids, title, full_name = [loan.id for loan in loans], book.title, reader.full_name
+
+    response = await async_client.get(
+        f"/borrowed_books/export.{columnar_format}",
+        params={"borrowed_from": f"{year}-01-01", "borrowed_to": f"{year}-01-20", "batch_size": 1},
+    )
+
+    assert response.status_code == 200
+    if columnar_format == "arrow":
+        table = pyarrow.ipc.open_stream(response.content).read_all()
+    else:
+        table = pyarrow.parquet.read_table(pa.BufferReader(response.content))
+    assert table.schema.field("borrowed_date").type == pa.date32()
+    assert table.column("id").to_pylist() == loan_ids[:2]
+    assert table.column("return_date").to_pylist() == [date(year, 1, 20), None]
+    assert set(table.column("book_title").to_pylist()) == {title}
+    assert set(table.column("reader_full_name").to_pylist()) == {full_name}
+
+
+@pytest.mark.asyncio
+async def test_export_loan_history_without_pyarrow(async_client: AsyncClient, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setitem(sys.modules, "pyarrow", None)
+
+    response = await async_client.get("/borrowed_books/export.arrow")
 
+    assert response.status_code == 501
@@ -0,0 +1,169 @@
+# Python std lib
+import asyncio
+
+# Third party
+import pytest
+from httpx import AsyncClient
+from sqlalchemy import event, select, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+# Local
+from src.config import settings
+from src.db import Database, InstrumentedQueuePool, ReplicaRouter, database, pool_stats
+from src.metrics import QueryBudgetExceeded
+from src.models import Book
+
+
+####################################################################################################
+# TESTS
+####################################################################################################
+
+
+@pytest.mark.asyncio
+async def test_instrumented_pool_reports_waiters():
+    engine = create_async_engine(
+        settings.get_test_db_url, poolclass=InstrumentedQueuePool, pool_size=1, max_overflow=0, pool_timeout=5
+    )
+    try:
+        async with engine.connect() as connection:
+            await connection.execute(text("SELECT 1"))
+            assert pool_stats(engine.pool)["checked_out"] == 1
+
+            async def second_checkout():
+                async with engine.connect() as second_connection:
+                    await second_connection.execute(text("SELECT 1"))
+
+            waiting = asyncio.create_task(second_checkout())
+            await asyncio.sleep(0.05)
+            assert pool_stats(engine.pool)["waiters"] == 1
+
+        await waiting
+        stats = pool_stats(engine.pool)
+        assert (stats["waiters"], stats["checked_out"], stats["acquire_count"]) == (0, 0, 2)
+        assert stats["acquire_seconds_total"] >= 0.05
+    finally:
+        await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_get_pool_stats(async_client: AsyncClient):
+    database.start()
+    response = await async_client.get("/health/pool")
+
+    assert response.status_code == 200
+    assert set(response.json()["primary"]) >= {"size", "checked_out", "overflow", "waiters"}
+
+    await database.dispose()
+    response = await async_client.get("/health/pool")
+    assert response.status_code == 503
+    assert not database.started
+
+
+def test_replica_router_round_robin_with_read_your_writes():
+    primary, first_replica, second_replica = (async_sessionmaker() for _ in range(3))
+    router = ReplicaRouter(primary, [first_replica, second_replica], strategy="round_robin", sticky_seconds=60)
+
+    assert [router.choose("client") for _ in range(3)] == [first_replica, second_replica, first_replica]
+
+    router.mark_write("writer")
+    assert router.choose("writer") is primary
+    assert router.choose("client") is second_replica
+
+
+def test_replica_router_without_sticky_window():
+    primary, replica = async_sessionmaker(), async_sessionmaker()
+    router = ReplicaRouter(primary, [replica], strategy="round_robin", sticky_seconds=0)
+
+    router.mark_write("writer")
+    router.mark_write("writer")
+
+    assert router.choose("writer") is replica
+
+
+def test_replica_router_without_replicas_uses_primary():
+    primary = async_sessionmaker()
+    router = ReplicaRouter(primary, [], strategy="least_busy", sticky_seconds=60)
+
+    assert router.choose("client") is primary
+
+
+@pytest.mark.asyncio
+async def test_get_metrics(async_client: AsyncClient):
+    database.start()
+    await async_client.get("/books/999999")
+    response = await async_client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    body = response.text
+    assert 'http_requests_total{method="GET",route="/books/{book_id}",status="404"}' in body
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/books/{book_id}",le="+Inf"}' in body
+    assert 'db_statement_duration_seconds_count{statement="SELECT"}' in body
+    assert 'db_pool_waiters{pool="primary"} 0' in body
+
+    await database.dispose()
+    await async_client.get("/metrics")
+    assert not database.started
+
+
+@pytest.mark.asyncio
+async def test_query_stats_headers_in_debug(async_client: AsyncClient, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(settings, "DEBUG", True)
+    response = await async_client.get("/readers/")
+
+    assert response.status_code == 200
+    assert response.headers["X-DB-Query-Count"] == "1"
+    assert float(response.headers["X-DB-Time-Ms"]) > 0
+
+
+@pytest.mark.asyncio
+async def test_query_budget_exceeded_fails_request(async_client: AsyncClient, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setitem(settings.DB_QUERY_BUDGETS, "GET /readers/", 0)
+
+    with pytest.raises(QueryBudgetExceeded, match="GET /readers/ executed 1 SQL statements, the budget is 0"):
+        await async_client.get("/readers/")
+
+
+@pytest.mark.asyncio
+async def test_database_warm_up_and_dispose():
+    test_database = Database(settings.get_test_db_url, [])
+    assert not test_database.started
+
+    await test_database.warm_up(2, [select(Book).where(Book.id == 0)])
+
+    assert test_database.ready
+    assert pool_stats(test_database.engine.pool)["checked_in"] == 2
+    await test_database.dispose()
+    assert not test_database.ready and not test_database.started
+
+
+@pytest.mark.asyncio
+async def test_database_warm_up_closes_opened_connections_on_failure():
+    test_database = Database(settings.get_test_db_url, [])
+    engine = test_database.engine
+    attempts = 0
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def flaky_connect(dbapi_connection, connection_record):
+        nonlocal attempts
+        attempts += 1
+        if attempts == 2:
+            raise ConnectionRefusedError("database is restarting")
+
+    with pytest.raises(ConnectionRefusedError):
+        await test_database.warm_up(3)
+
+    assert not test_database.ready
+    assert pool_stats(engine.pool)["checked_out"] == 0
+    await test_database.dispose()
+
+
+@pytest.mark.asyncio
+async def test_readiness_reports_warm_up(async_client: AsyncClient, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(database, "ready", False)
+    response = await async_client.get("/health/ready")
+    assert (response.status_code, response.json()) == (503, {"status": "warming_up"})
+
+    monkeypatch.setattr(database, "ready", True)
+    response = await async_client.get("/health/ready")
+    assert (response.status_code, response.json()) == (200, {"status": "ready"})